@@ -0,0 +1,165 @@
+"""
+Runs the board on one asyncio event loop instead of a thread per job, with RUNTIME=asyncio.
+
+The loop watches the MQTT client's socket, so messages are handled as soon as they
+arrive without paho's network thread. Fetchers are tasks that make their blocking
+HTTP requests on a small pool of threads of their own, and the render loop is a task woken
+by the same update_event as in the threaded runtime. Flask and the network monitor
+keep their own threads.
+"""
+import ssl
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+from netmon import PROBE_INTERVAL
+
+# Threads for other blocking work: boot jobs like downloading icons, connecting to MQTT
+# and the Wi-Fi setup commands. Fetchers get a thread each on a pool of their own, so
+# they never wait behind a slow boot job.
+WORKERS = 4
+
+# Seconds to wait before reconnecting to MQTT, doubling after each failure up to the max
+RECONNECT_DELAY = 2
+MAX_RECONNECT_DELAY = 120
+
+
+class AsyncMqtt:
+    """
+    Drives a paho client from the event loop: the loop calls loop_read/loop_write when
+    the client's socket is ready and loop_misc every second for keepalives. paho
+    reports socket changes from whichever thread caused them, e.g. the worker that
+    connected, so they are passed on to the loop's thread.
+    """
+
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+        self.disconnected = asyncio.Event()
+        self._loop_thread = threading.get_ident()
+
+        client.on_socket_open = lambda client, userdata, sock: self._call(self._opened, sock)
+        client.on_socket_close = lambda client, userdata, sock: self._call(self._closed, sock)
+        client.on_socket_register_write = lambda client, userdata, sock: self._call(loop.add_writer, sock, client.loop_write)
+        client.on_socket_unregister_write = lambda client, userdata, sock: self._call(loop.remove_writer, sock)
+
+    def _call(self, fn, *args):
+        # Straight away on the loop's thread, so a closed socket is never left registered
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _opened(self, sock):
+        self.disconnected.clear()
+        self.loop.add_reader(sock, self._read, sock)
+
+    def _closed(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self.disconnected.set()
+
+    def _read(self, sock):
+        self.client.loop_read()
+        # TLS can leave decrypted bytes buffered that the socket won't report as readable
+        while self.client.socket() is sock and getattr(sock, "pending", lambda: 0)():
+            self.client.loop_read()
+
+    async def keepalive(self):
+        while True:
+            await asyncio.sleep(1)
+            self.client.loop_misc()
+
+    async def run(self, host, port):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                # Resolving the broker and the TLS handshake block, so they happen on a worker
+                await self.loop.run_in_executor(None, self.client.connect, host, port, 60)
+            except Exception as e:
+                print("MQTT connection error:", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+
+            delay = RECONNECT_DELAY
+            await self.disconnected.wait()
+            print("Disconnected from MQTT broker, reconnecting")
+            await asyncio.sleep(delay)
+
+
+async def watch_network(board):
+    loop = asyncio.get_running_loop()
+    board.network.start()
+    await loop.run_in_executor(None, board.network.checked.wait)
+    board.boot_stage("network_checked")
+
+    while True:
+        # Starting or stopping the access point runs commands, so that happens on a worker
+        await loop.run_in_executor(None, board.update_wifi_setup)
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def publish_metrics(board):
+    while True:
+        await asyncio.sleep(board.METRICS_INTERVAL)
+        board.publish_status()
+
+
+async def show_board(board):
+    state = board.ModeState()
+    pacer = board.board_pacer()
+    mode = None
+
+    while True:
+        mode = board.board_frame(state, pacer, mode)
+        await pacer.wait_async(board.FRAME_INTERVALS[mode], align_to_second=(mode == "clock"))
+
+
+async def show_remote_frames(board):
+    mode = shown = None
+
+    while True:
+        mode, shown = board.remote_frame_shown(mode, shown)
+        if not await board.update_event.wait_async(board.REMOTE_FRAME_TIMEOUT) and mode != "off":
+            board.request_frames()
+        board.update_event.clear()
+
+
+async def run(board):
+    """
+    Runs the board. `board` is the main module, which has already shown the splash screen.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="worker")
+    loop.set_default_executor(executor)
+
+    # Serves /metrics for Prometheus, and the Wi-Fi setup form without a network
+    threading.Thread(target=board.run_flask, daemon=True).start()
+
+    client = mqtt.Client(client_id=board.BOARD_ID)
+    client.username_pw_set(board.MQTT_USERNAME, board.MQTT_PASSWORD)
+    client.on_connect = board.on_connect
+    client.on_message = board.on_message
+    client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+    board.client = client
+    connection = AsyncMqtt(client, loop)
+
+    tasks = [
+        connection.run(board.MQTT_BROKER, board.MQTT_PORT),
+        connection.keepalive(),
+        watch_network(board),
+        publish_metrics(board),
+    ]
+
+    if board.FRAME_SOURCE == "remote":
+        tasks.append(show_remote_frames(board))
+    else:
+        loop.run_in_executor(None, board.load_stations)
+        # Download any weather icons that aren't cached yet
+        loop.run_in_executor(None, board.warm_weather_icons)
+        fetch_executor = ThreadPoolExecutor(max_workers=len(board.fetchers), thread_name_prefix="fetch")
+        tasks += [fetcher.run_async(loop, fetch_executor) for fetcher in board.fetchers]
+        tasks.append(show_board(board))
+
+    await asyncio.gather(*tasks)
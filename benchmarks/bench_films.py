@@ -0,0 +1,71 @@
+"""
+Checks the Jam Jar scraper against a saved 'Now Playing' page and times it against
+the previous full-document parse.
+
+Needs BeautifulSoup for the comparison, from benchmarks/requirements.txt. Run from
+the repository root:
+    python benchmarks/bench_films.py
+"""
+import os
+import sys
+import json
+import time
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import get_films
+from get_films import parse_jamjar_films
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+RUNS = 20
+
+
+def parse_whole_page(html):
+    # The parse the scraper did before: build a tree for the whole page, then find the app
+    soup = BeautifulSoup(html, 'html.parser')
+    return soup.find('div', id='q-app').find_all('a')
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        result = fn()
+    return (time.perf_counter() - start) / RUNS, result
+
+
+def main():
+    with open(os.path.join(FIXTURES, "jamjar_now_playing.html")) as f:
+        html = f.read()
+    with open(os.path.join(FIXTURES, "jamjar_now_playing.json")) as f:
+        expected = json.load(f)
+
+    films = parse_jamjar_films(html)
+    result = {film.title: [showtime.time for showtime in film.showtimes] for film in films}
+    if result != expected:
+        print("Parsed films do not match the fixture:")
+        print(json.dumps(result, indent=4))
+        sys.exit(1)
+    print(f"OK: {len(films)} films match the fixture")
+
+    print(f"page size: {len(html) / 1024:.0f} KiB")
+    before, _ = timed(lambda: parse_whole_page(html))
+    print(f"  whole page, html.parser: {before * 1000:7.1f} ms")
+
+    parsers = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+        parsers.append("lxml")
+    except ImportError:
+        print("  (lxml not installed, skipping)")
+
+    for parser in parsers:
+        get_films.HTML_PARSER = parser
+        after, films = timed(lambda: parse_jamjar_films(html))
+        assert {f.title: [s.time for s in f.showtimes] for f in films} == expected, parser
+        print(f"  q-app only, {parser + ':':12} {after * 1000:7.1f} ms  ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares the glyph atlas text path against PIL's FreeType path for the board's fonts.
+
+Run from the repository root:
+    python benchmarks/bench_fonts.py
+"""
+import os
+import sys
+import time
+from PIL import Image, ImageDraw, ImageFont
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from glyph_atlas import GlyphFont, compile_bdf
+
+FONTS = [("5x8.bdf", 8), ("4x6.bdf", 6), ("10x20.bdf", 20)]
+
+# Roughly what one frame of each mode draws
+STRINGS = [
+    "Monument: 1", "South Hylton", "St James", "Due", "12", "There are no services",
+    "9:00", "12:00", "15:00", "18:00", "14°", "80%", "3.5", "↑17°", "↓8°", "ƀ2.1",
+    "12:34:56", "Sat 17 Oct", "1/3",
+]
+FRAMES = 500
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def draw_frames(draw_string):
+    image = Image.new("RGB", (96, 48))
+    for _ in range(FRAMES):
+        for i, text in enumerate(STRINGS):
+            draw_string(image, (1 + i % 4 * 20, i % 8 * 6), text)
+
+
+def main():
+    for name, size in FONTS:
+        bdf_path = os.path.join(ROOT, name)
+        atlas_path = os.path.splitext(bdf_path)[0] + ".atlas"
+
+        compile_time, _ = timed(lambda: compile_bdf(bdf_path, atlas_path))
+        atlas_load, glyph_font = timed(lambda: GlyphFont(atlas_path), repeat=10)
+        atlas_draw, _ = timed(lambda: draw_frames(lambda image, xy, text: glyph_font.draw(image, xy, text, (246, 115, 25))))
+
+        print(f"\n{name}")
+        print(f"  atlas compile (build step): {compile_time * 1000:8.1f} ms")
+        print(f"  atlas load:                 {atlas_load * 1000:8.2f} ms")
+
+        try:
+            pil_load, pil_font = timed(lambda: ImageFont.truetype(bdf_path, size), repeat=10)
+        except OSError as e:
+            print(f"  PIL load:                   failed ({e})")
+            print(f"  atlas draw per frame:       {atlas_draw / FRAMES * 1e6:8.1f} us")
+            continue
+
+        def pil_draw(image, xy, text):
+            ImageDraw.Draw(image).text(xy, text, font=pil_font, fill=(246, 115, 25))
+
+        pil_draw_time, _ = timed(lambda: draw_frames(pil_draw))
+
+        print(f"  PIL load:                   {pil_load * 1000:8.2f} ms")
+        print(f"  PIL draw per frame:         {pil_draw_time / FRAMES * 1e6:8.1f} us")
+        print(f"  atlas draw per frame:       {atlas_draw / FRAMES * 1e6:8.1f} us  ({pil_draw_time / atlas_draw:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares per-render forecast work before and after the Forecast model, using a
+recorded open-meteo response.
+
+Run from the repository root:
+    python benchmarks/bench_forecast.py
+"""
+import os
+import sys
+import json
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from forecast import Forecast
+
+FIXTURE = os.path.join(ROOT, "benchmarks", "fixtures", "open_meteo_forecast.json")
+DAY = date(2025, 6, 1)
+NOW = datetime(2025, 6, 1, 14, 30)
+FORECAST_HOURS = [9, 12, 15, 18]
+RENDERS = 2000
+
+
+def parse_per_render(data):
+    # What showWeather() and showWeatherGraph() each did on every render before the model
+    hourly = data["hourly"]
+    forecast_hours = {}
+    times, temps, precip, uv = [], [], [], []
+    for i, t in enumerate(hourly["time"]):
+        dt = datetime.fromisoformat(t)
+        if dt.date() == NOW.date():
+            if dt.hour in FORECAST_HOURS:
+                forecast_hours[dt.hour] = {
+                    "temp": hourly["temperature_2m"][i],
+                    "precipitation_probability": hourly["precipitation_probability"][i],
+                    "code": hourly["weathercode"][i],
+                    "uv_index": hourly["uv_index"][i],
+                    "is_day": bool(hourly["is_day"][i])
+                }
+    for i, t in enumerate(hourly["time"]):
+        dt = datetime.fromisoformat(t)
+        if dt.date() == NOW.date():
+            times.append(dt)
+            temps.append(hourly["temperature_2m"][i])
+            precip.append(hourly["precipitation_probability"][i])
+            uv.append(hourly["uv_index"][i])
+    current = next((i for i, dt in enumerate(times) if dt.hour == NOW.hour), -1)
+    return forecast_hours, min(temps), max(temps), temps[current]
+
+
+def lookup_per_render(forecast):
+    return forecast.forecast_hours, forecast.min_temp, forecast.max_temp, forecast.current(NOW.hour)["temp"]
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    with open(FIXTURE) as f:
+        data = json.load(f)
+
+    build_time, forecast = timed(lambda: Forecast(data, FORECAST_HOURS, DAY), 200)
+    before, expected = timed(lambda: parse_per_render(data), RENDERS)
+    after, result = timed(lambda: lookup_per_render(forecast), RENDERS)
+
+    # Both paths have to agree before the timings mean anything
+    assert result[0] == expected[0]
+    assert (result[1], result[2], result[3]) == (expected[1], expected[2], expected[3])
+
+    print(f"hours in fixture:          {len(data['hourly']['time'])}")
+    print(f"model build (once/fetch):  {build_time * 1e6:8.1f} us")
+    print(f"per render, parsing:       {before * 1e6:8.1f} us")
+    print(f"per render, model lookups: {after * 1e6:8.1f} us  ({before / after:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Renders every display mode from recorded API responses and reports per-frame
+latency and allocations. Runs on any Linux machine: the board is imported with the
+null display backend and simulated GPIO pins, and nothing touches the network.
+
+Each mode is timed twice: "new data" renders the first frame after a fresh snapshot
+(the cost every cache pays once per fetch), "steady" repeats frames with unchanged data.
+Allocations are the blocks a frame leaves alive and the peak memory traced while drawing it.
+
+Run from the repository root:
+    python benchmarks/bench_render.py [--frames N] [--budget-ms MS] [--dump DIR]
+
+With --budget-ms the script exits non-zero if any mode's p95 frame time is over
+budget, so it can gate CI. --dump saves each mode's last frame as a PNG.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # Fonts and icons are loaded relative to the repository
+
+os.environ["DISPLAY_BACKEND"] = "null"
+os.environ.setdefault("BOARD_ID", "bench")
+
+with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+    import main
+
+from forecast import Forecast
+from get_films import parse_jamjar_films
+from metro import PlatformTimes
+from listings import Listing
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+FORECAST_DAY = date(2025, 6, 1)
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def fixture_data():
+    metro = json.loads(load_fixture("metro_times.json"))
+    forecast = json.loads(load_fixture("open_meteo_forecast.json"))
+    films = parse_jamjar_films(load_fixture("jamjar_now_playing.html"))
+    messages = json.loads(load_fixture("messages.json"))
+
+    main.stations = {"TYN": "Tynemouth"}
+
+    def publish_metro():
+        times = []
+        for key, trains in metro.items():
+            station, platform = key.split("/")
+            times.append(PlatformTimes(station, platform, tuple(trains), 0, None))
+        main.metro_fetcher.publish(main.departure_tracker.update(times))
+
+    def publish_weather():
+        main.weather_fetcher.publish(Forecast(forecast, main.settings["forecast_hours"], FORECAST_DAY))
+
+    def publish_films():
+        main.films_fetcher.publish([Listing(f.title, "Jam Jar", f.showtimes) for f in films])
+
+    def publish_messages():
+        main.message_store.apply_snapshot(messages["messages"], messages["seq"])
+        main.message_pages = None  # Page layouts are cached by content, so start from scratch
+
+    def reset_clock():
+        main.clock_cache["date_text"] = None
+
+    return publish_metro, publish_weather, publish_films, publish_messages, reset_clock
+
+
+def scenarios():
+    publish_metro, publish_weather, publish_films, publish_messages, reset_clock = fixture_data()
+    films_frame = iter(range(10 ** 9))
+
+    # (mode, prepare for a new-data frame, render one frame)
+    return [
+        ("metro", publish_metro, main.showMetro),
+        ("weather", publish_weather, main.showWeather),
+        ("weather_graph", publish_weather, main.showWeatherGraph),
+        ("films", publish_films, lambda: main.showFilms(next(films_frame), 0)),
+        ("messages", publish_messages, lambda: main.showMessages(page=0)[0]),
+        ("clock", reset_clock, main.showClock),
+        ("link", lambda: None, main.showLink),
+    ]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def time_frames(prepare, render, frames, fresh):
+    samples = []
+    image = None
+    for _ in range(frames):
+        if fresh:
+            prepare()
+        start = time.perf_counter()
+        image = render()
+        samples.append(time.perf_counter() - start)
+    return samples, image
+
+
+def allocations(prepare, render, frames, fresh):
+    # Measured in a separate pass as tracing slows every allocation down
+    tracemalloc.start()
+    total_blocks = 0
+    peak = 0
+    for _ in range(frames):
+        if fresh:
+            prepare()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        base, _ = tracemalloc.get_traced_memory()
+        render()
+        _, frame_peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        total_blocks += sum(max(stat.count_diff, 0) for stat in after.compare_to(before, "filename"))
+        peak = max(peak, frame_peak - base)
+    tracemalloc.stop()
+    return total_blocks / frames, peak
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200, help="frames timed per mode and pass")
+    parser.add_argument("--budget-ms", type=float, help="fail if any p95 frame time is over this")
+    parser.add_argument("--dump", help="directory to save each mode's last frame to")
+    args = parser.parse_args()
+
+    print(f"{'mode':14} {'pass':9} {'mean':>9} {'p95':>9} {'max':>9} {'blocks':>8} {'peak':>9}")
+    over_budget = []
+
+    with open(os.devnull, "w") as devnull:
+        for mode, prepare, render in scenarios():
+            prepare()
+            for label, fresh in (("new data", True), ("steady", False)):
+                with redirect_stdout(devnull):
+                    render()  # Warm up
+                    samples, image = time_frames(prepare, render, args.frames, fresh)
+                    blocks, peak = allocations(prepare, render, min(args.frames, 20), fresh)
+
+                mean = sum(samples) / len(samples)
+                p95 = percentile(samples, 0.95)
+                print(f"{mode:14} {label:9} {mean * 1e3:7.3f}ms {p95 * 1e3:7.3f}ms {max(samples) * 1e3:7.3f}ms "
+                      f"{blocks:8.0f} {peak / 1024:7.1f}KiB")
+
+                if args.budget_ms is not None and p95 * 1e3 > args.budget_ms:
+                    over_budget.append(f"{mode} ({label})")
+
+            if args.dump and image is not None:
+                os.makedirs(args.dump, exist_ok=True)
+                image.save(os.path.join(args.dump, f"{mode}.png"))
+
+    if over_budget:
+        print(f"Over the {args.budget_ms}ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
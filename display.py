@@ -0,0 +1,328 @@
+import os
+import time
+import struct
+import atexit
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from PIL import Image
+
+# Where frames go: "matrix" drives the LED panel, "png" writes every frame to
+# DISPLAY_DUMP_DIR and "null" discards them. The last two work on any machine.
+DISPLAY_BACKEND = os.getenv("DISPLAY_BACKEND", "matrix")
+DISPLAY_DUMP_DIR = os.getenv("DISPLAY_DUMP_DIR", "frames")
+
+# With DISPLAY_PROCESS=1 the backend runs in its own process (see DisplayProcess)
+DISPLAY_PROCESS = os.getenv("DISPLAY_PROCESS", "0") == "1"
+
+MATRIX_ROWS = 48
+MATRIX_COLS = 96
+
+
+def create_matrix(backend=DISPLAY_BACKEND):
+    """
+    Returns the display for `backend`. Every backend has the parts of the RGBMatrix
+    interface the board uses: width, height, brightness and frame canvases.
+    """
+    if backend == "png":
+        return PngDumpSink(MATRIX_COLS, MATRIX_ROWS, DISPLAY_DUMP_DIR)
+    if backend == "null":
+        return NullSink(MATRIX_COLS, MATRIX_ROWS)
+    if backend != "matrix":
+        raise ValueError(f"Unknown display backend: {backend}")
+
+    # Only importable on the Pi
+    from rgbmatrix import RGBMatrix, RGBMatrixOptions
+
+    options = RGBMatrixOptions()
+    options.rows = MATRIX_ROWS
+    options.cols = MATRIX_COLS
+    options.chain_length = 1
+    options.parallel = 1
+    options.hardware_mapping = 'regular'
+    options.brightness = 100
+    options.pwm_lsb_nanoseconds = 130
+    options.pwm_bits = 11
+    options.gpio_slowdown = 2
+    options.disable_hardware_pulsing = True
+
+    return RGBMatrix(options=options)
+
+
+class SinkCanvas:
+    def __init__(self, width, height):
+        self.brightness = 100
+        self.image = Image.new("RGB", (width, height), (0, 0, 0))
+
+    def SetImage(self, image):
+        self.image = image
+
+    def Clear(self):
+        self.image = Image.new("RGB", self.image.size, (0, 0, 0))
+
+
+class NullSink:
+    """
+    A display with no panel behind it. Frames are counted and otherwise discarded.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.brightness = 100
+        self.frames = 0
+
+    def CreateFrameCanvas(self):
+        return SinkCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas):
+        self.frames += 1
+        self.write(canvas)
+        return self.CreateFrameCanvas()
+
+    def write(self, canvas):
+        pass
+
+
+class PngDumpSink(NullSink):
+    """
+    Writes every frame to `directory` as a numbered PNG, with brightness applied.
+    """
+
+    def __init__(self, width, height, directory):
+        super().__init__(width, height)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, canvas):
+        image = canvas.image
+        if canvas.brightness < 100:
+            image = image.point(lambda value: value * canvas.brightness // 100)
+        image.save(os.path.join(self.directory, f"frame_{self.frames:06}.png"))
+
+
+def full_frame(image, size):
+    # The canvas being drawn on still holds the frame before last, so pad to full size
+    if image.size != size:
+        frame = Image.new("RGB", size, (0, 0, 0))
+        frame.paste(image.convert("RGB"), (0, 0))
+        return frame
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+class FramePresenter:
+    """
+    Pushes frames to the matrix through an off-screen canvas swapped on vsync. A frame
+    identical to the one already on the panel is skipped rather than pushed again.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.canvas = matrix.CreateFrameCanvas()
+        self.last_frame = None
+
+        # Counters for how often rendering actually changed the panel
+        self.frames_pushed = 0
+        self.frames_skipped = 0
+
+    def show(self, image):
+        image = full_frame(image, (self.matrix.width, self.matrix.height))
+
+        brightness = self.matrix.brightness
+        frame = (image.tobytes(), brightness)
+        if frame == self.last_frame:
+            self.frames_skipped += 1
+            return False
+
+        self.canvas.brightness = brightness
+        self.canvas.SetImage(image)
+        self.canvas = self.matrix.SwapOnVSync(self.canvas)
+
+        self.last_frame = frame
+        self.frames_pushed += 1
+        return True
+
+    def clear(self):
+        self.canvas.Clear()
+        self.canvas = self.matrix.SwapOnVSync(self.canvas)
+        self.last_frame = None
+
+
+# Shared framebuffer layout: the index of the front slot, then a sequence number per
+# slot (odd while it is being written), then the two slots of RGB pixels
+SHARED_HEADER = struct.Struct("<B3xII")
+
+# How long the reader backs off for when it catches a slot being written, in seconds
+READ_RETRY_DELAY = 0.0005
+
+
+class SharedFrameBuffer:
+    """
+    Two frame slots in shared memory. The writer fills the slot that isn't on show and
+    then flips the front index; each slot's sequence number lets the reader detect a
+    slot that was rewritten while it was copying it, and try again.
+    """
+
+    def __init__(self, width, height):
+        self.size = (width, height)
+        self.frame_bytes = width * height * 3
+        self.block = shared_memory.SharedMemory(create=True, size=SHARED_HEADER.size + 2 * self.frame_bytes)
+        self.block.buf[:SHARED_HEADER.size] = SHARED_HEADER.pack(0, 0, 0)
+
+    def _slot(self, index):
+        start = SHARED_HEADER.size + index * self.frame_bytes
+        return slice(start, start + self.frame_bytes)
+
+    def write(self, pixels):
+        buf = self.block.buf
+        front, *seqs = SHARED_HEADER.unpack_from(buf)
+        back = 1 - front
+
+        seqs[back] += 1  # Odd: being written
+        SHARED_HEADER.pack_into(buf, 0, front, *seqs)
+        buf[self._slot(back)] = pixels
+        seqs[back] += 1
+        SHARED_HEADER.pack_into(buf, 0, back, *seqs)
+
+    def read(self):
+        buf = self.block.buf
+        while True:
+            front, *seqs = SHARED_HEADER.unpack_from(buf)
+            if seqs[front] % 2 == 0:
+                pixels = bytes(buf[self._slot(front)])
+                if SHARED_HEADER.unpack_from(buf)[1 + front] == seqs[front]:
+                    return Image.frombytes("RGB", self.size, pixels)
+            # The writer is part way through; give it the CPU rather than spinning
+            time.sleep(READ_RETRY_DELAY)
+
+    def close(self, unlink=False):
+        self.block.close()
+        if unlink:
+            self.block.unlink()
+
+
+def _run_display(backend, frames, control):
+    # The display process: owns the panel and blits whatever the worker last wrote
+    matrix = create_matrix(backend)
+    presenter = FramePresenter(matrix)
+
+    try:
+        while True:
+            message = control.recv()
+            # Only the newest frame matters if several arrived while the last was shown
+            while message[0] == "frame" and control.poll():
+                message = control.recv()
+
+            if message[0] == "frame":
+                matrix.brightness = message[1]
+                presenter.show(frames.read())
+            elif message[0] == "clear":
+                presenter.clear()
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        presenter.clear()
+        frames.close()
+
+
+class DisplayProcess:
+    """
+    Drives the panel from a separate process, so its refresh isn't competing for the
+    GIL with fetching, MQTT, Flask and drawing. Frames go through a SharedFrameBuffer
+    and commands over a pipe. Has the same interface as FramePresenter; `matrix` only
+    needs the panel's size and brightness. If the display process dies, frames are
+    presented from this process instead.
+    """
+
+    def __init__(self, matrix, backend=DISPLAY_BACKEND):
+        self.matrix = matrix
+        self.backend = backend
+        self.frames = SharedFrameBuffer(matrix.width, matrix.height)
+        self.last_frame = None
+        self.process = None
+        self._control = None
+        self._local = None  # FramePresenter used after the display process has died
+
+        self.frames_pushed = 0
+        self.frames_skipped = 0
+
+    def start(self):
+        # Forked, as spawning would run the board's main module again in the child. Call
+        # this before starting any threads so the child doesn't inherit one mid-lock.
+        if threading.active_count() > 1:
+            print("Starting the display process with threads running:", [t.name for t in threading.enumerate()])
+        context = multiprocessing.get_context("fork")
+        receiver, self._control = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_run_display,
+            args=(self.backend, self.frames, receiver),
+            name="display",
+            daemon=True
+        )
+        self.process.start()
+        receiver.close()
+        atexit.register(self.stop)
+
+    def show(self, image):
+        if self._local:
+            return self._show_local(image)
+
+        image = full_frame(image, (self.matrix.width, self.matrix.height))
+
+        brightness = self.matrix.brightness
+        frame = (image.tobytes(), brightness)
+        if frame == self.last_frame:
+            self.frames_skipped += 1
+            return False
+
+        self.frames.write(frame[0])
+        if not self._send(("frame", brightness)):
+            return self._show_local(image)
+
+        self.last_frame = frame
+        self.frames_pushed += 1
+        return True
+
+    def clear(self):
+        if not self._local:
+            if self.last_frame is None or self._send(("clear",)):
+                self.last_frame = None
+                return
+        self._local.clear()
+
+    def _send(self, message):
+        if self._control is None:
+            # Never started, e.g. when the board is imported by a benchmark or render server
+            self.frames.close(unlink=True)
+            self._fall_back()
+            return False
+        try:
+            self._control.send(message)
+            return True
+        except OSError as e:  # BrokenPipeError once the display process has gone
+            print("Display process stopped, presenting frames from this process:", e)
+            self.stop()
+            self._fall_back()
+            return False
+
+    def _fall_back(self):
+        self._local = FramePresenter(create_matrix(self.backend))
+
+    def _show_local(self, image):
+        self._local.matrix.brightness = self.matrix.brightness
+        pushed = self._local.show(image)
+        if pushed:
+            self.frames_pushed += 1
+        else:
+            self.frames_skipped += 1
+        return pushed
+
+    def stop(self):
+        if self.process is None:
+            return
+        self._control.close()  # The display process clears the panel and exits
+        self.process.join(timeout=2)
+        self.process = None
+        self.frames.close(unlink=True)
@@ -0,0 +1,153 @@
+import math
+import threading
+import time
+from collections import namedtuple
+import metrics
+from pacing import WakeEvent
+
+# The latest data a fetcher has published and the wall-clock time it was fetched.
+# Snapshots are replaced, never modified, so render code can read one without locking.
+Snapshot = namedtuple("Snapshot", ["data", "timestamp"])
+
+# How soon to try again after a failed fetch, if that is sooner than the normal interval
+RETRY_INTERVAL = 30
+
+# The longest any one fetch may take, however long the fetcher's interval
+MAX_FETCH_TIME = 20
+
+
+class Fetcher:
+    """
+    Polls one data source on its own daemon thread and publishes the result as a Snapshot.
+
+    `fetch` is called with a deadline, the time.monotonic() by which it should give up:
+    before the next fetch would be due, and within MAX_FETCH_TIME. It should return the
+    new data, or None if the fetch failed (the previous snapshot is kept). `interval` is in seconds, or a callable
+    returning the number of seconds to wait after a successful fetch. An interval of None
+    means only fetch once, and again whenever refresh() is called. `active` is an optional callable; while
+    it returns False the fetcher stops polling, so sources that aren't on screen don't
+    hit their APIs. `on_update` is called after every new snapshot is published.
+    `load_cached` optionally returns a Snapshot of stored data to show until the first
+    fetch completes. `available` is an optional callable saying whether the source can
+    be reached; while it returns False fetches are skipped and the last snapshot is
+    kept, rather than waiting out a timeout that is bound to happen.
+
+    While a fetch is failing, latest() keeps returning the last good snapshot and
+    stale() says so, so it can be shown with a marker rather than not at all.
+    """
+
+    def __init__(self, name, fetch, interval, active=None, on_update=None, load_cached=None, available=None):
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        self.active = active
+        self.on_update = on_update
+        self.load_cached = load_cached
+        self.available = available
+
+        self._snapshot = None
+        self._fresh = False  # Whether the snapshot came from the last fetch attempted
+        self._next_fetch = 0
+        self._wake = WakeEvent()
+        self._thread = None
+
+        metrics.registry.gauge("data_age_seconds", "Age of the data each fetcher is serving", fn=self.age, fetcher=name)
+
+    def start(self):
+        self._load_cached()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"fetch-{self.name}", daemon=True)
+            self._thread.start()
+
+    async def run_async(self, loop, executor):
+        """
+        Polls as a task on `loop` instead of on a thread of its own, making each fetch
+        on `executor`. Used in place of start() by the asyncio runtime.
+        """
+        self._load_cached()
+        while True:
+            timeout = await loop.run_in_executor(executor, self._step)
+            await self._wake.wait_async(timeout)
+            self._wake.clear()
+
+    def _load_cached(self):
+        if self._snapshot is None and self.load_cached:
+            # Serve stale data straight away; it is refreshed as soon as the fetcher is active
+            try:
+                self._snapshot = self.load_cached()
+            except Exception as e:
+                print(f"Error loading cached {self.name}:", e)
+
+    def latest(self):
+        return self._snapshot
+
+    def stale(self):
+        # True while showing cached data, or data from before a fetch that failed or was skipped
+        return self._snapshot is not None and not self._fresh
+
+    def age(self):
+        # Seconds since the latest snapshot was fetched, or None if there isn't one
+        snapshot = self._snapshot
+        return None if snapshot is None else time.time() - snapshot.timestamp
+
+    def publish(self, data, timestamp=None):
+        # Replace the snapshot with data from elsewhere, e.g. a recorded fixture
+        self._snapshot = Snapshot(data, timestamp or time.time())
+        self._fresh = True
+        if self.on_update:
+            self.on_update()
+
+    def refresh(self):
+        # Fetch again as soon as possible, e.g. after the settings change
+        self._next_fetch = 0
+        self._wake.set()
+
+    def poke(self):
+        # Re-check whether the fetcher is active, e.g. after a mode change
+        self._wake.set()
+
+    def _interval(self):
+        interval = self.interval() if callable(self.interval) else self.interval
+        return math.inf if interval is None else interval
+
+    def _is_active(self):
+        return self.active is None or self.active()
+
+    def _fetch_once(self):
+        if self.available and not self.available():
+            # Call refresh() when the source is back to fetch straight away
+            metrics.registry.counter("fetch_skipped_total", "Fetches skipped as the source was unreachable, per fetcher", fetcher=self.name).inc()
+            self._fresh = False
+            self._next_fetch = time.monotonic() + min(self._interval(), RETRY_INTERVAL)
+            return
+
+        start = time.monotonic()
+        try:
+            data = self.fetch(start + min(self._interval(), MAX_FETCH_TIME))
+        except Exception as e:
+            print(f"Error fetching {self.name}:", e)
+            data = None
+        metrics.registry.histogram("fetch_seconds", "Time for a whole fetch, per fetcher", fetcher=self.name).observe(time.monotonic() - start)
+
+        if data is None:
+            metrics.registry.counter("fetch_errors_total", "Failed fetches, per fetcher", fetcher=self.name).inc()
+            self._fresh = False
+            self._next_fetch = time.monotonic() + min(self._interval(), RETRY_INTERVAL)
+            return
+
+        self.publish(data)
+        self._next_fetch = time.monotonic() + self._interval()
+
+    def _step(self):
+        # Fetches if one is due. Returns how long to sleep, or None to wait to be woken.
+        if not self._is_active():
+            return None
+        if time.monotonic() >= self._next_fetch:
+            self._fetch_once()
+        timeout = self._next_fetch - time.monotonic()
+        return None if timeout == math.inf else max(timeout, 0)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._step())
+            self._wake.clear()
@@ -0,0 +1,55 @@
+import numpy as np
+from datetime import date
+
+
+class Forecast:
+    """
+    One day of an open-meteo hourly forecast, built once per fetch. Columns are NumPy
+    arrays in hour order, and the per-hour records and derived values both weather
+    views need are precomputed so rendering only does lookups.
+    """
+
+    def __init__(self, data, forecast_hours, day=None):
+        hourly = data["hourly"]
+        self.date = day or date.today()
+
+        # Timestamps are ISO strings ("2025-06-01T09:00"), so the date is a prefix and the hour is fixed-width
+        prefix = self.date.isoformat()
+        rows = [i for i, t in enumerate(hourly["time"]) if t.startswith(prefix)]
+
+        self.hours = np.array([int(hourly["time"][i][11:13]) for i in rows], dtype=int)
+        self.temps = np.array([hourly["temperature_2m"][i] for i in rows], dtype=float)
+        self.precipitation = np.array([hourly["precipitation_probability"][i] for i in rows], dtype=float)
+        self.uv_index = np.array([hourly["uv_index"][i] for i in rows], dtype=float)
+
+        # Records keep the API's own values so they format exactly as received
+        self.records = {}
+        for i in rows:
+            self.records[int(hourly["time"][i][11:13])] = {
+                "temp": hourly["temperature_2m"][i],
+                "precipitation_probability": hourly["precipitation_probability"][i],
+                "code": hourly["weathercode"][i],
+                "uv_index": hourly["uv_index"][i],
+                "is_day": bool(hourly["is_day"][i])
+            }
+
+        self.forecast_hours = {hour: self.records[hour] for hour in forecast_hours if hour in self.records}
+        self.codes = set(hourly["weathercode"][i] for i in rows)
+
+        if rows:
+            self.min_temp = self.temps.min()
+            self.max_temp = self.temps.max()
+        else:
+            self.min_temp = self.max_temp = None
+
+    def __len__(self):
+        return len(self.hours)
+
+    def current(self, hour):
+        """
+        Returns the record for `hour`, or for the last hour of the day if it is missing.
+        """
+        record = self.records.get(hour)
+        if record is None and self.records:
+            record = self.records[int(self.hours[-1])]
+        return record
@@ -0,0 +1,157 @@
+import time
+import struct
+import numpy as np
+from PIL import Image
+
+# Frames sent from the render server to boards. Each frame is a small header, a
+# palette of the colours it uses, then (run length - 1, palette index) byte pairs
+# covering every pixel in row order. A delta frame only carries the pixels that
+# changed since the frame before it; the rest are the KEEP index.
+#
+# Header: magic, kind, sequence number, width, height, brightness, palette size
+HEADER = struct.Struct("<2sBHHHBB")
+MAGIC = b"LF"
+
+KEYFRAME = 0
+DELTA = 1
+
+KEEP = 255  # Palette index meaning "unchanged since the previous frame"
+MAX_COLOURS = 255
+MAX_RUN = 256
+
+# Send a full frame at least this often, in seconds, so a board that missed one recovers
+KEYFRAME_INTERVAL = 30
+
+
+class MissingFrame(Exception):
+    """
+    Raised when a delta frame doesn't follow on from the last frame decoded.
+    """
+
+
+def _pack(rgb):
+    # One uint32 per pixel, so colours can be compared and counted in a single pass
+    rgb = rgb.reshape(-1, 3).astype(np.uint32)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+
+def _unpack(packed):
+    return np.stack(((packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF), axis=-1).astype(np.uint8)
+
+
+def _runs(indices):
+    """
+    Run-length encodes an array of palette indices into (length - 1, index) byte pairs.
+    """
+    starts = np.flatnonzero(np.concatenate(([True], indices[1:] != indices[:-1])))
+    lengths = np.diff(np.append(starts, len(indices)))
+    values = indices[starts]
+
+    # A run longer than a byte can count is split into full runs and a remainder
+    chunks = (lengths + MAX_RUN - 1) // MAX_RUN
+    chunk_lengths = np.full(chunks.sum(), MAX_RUN)
+    chunk_lengths[np.cumsum(chunks) - 1] = lengths - MAX_RUN * (chunks - 1)
+
+    return np.column_stack((chunk_lengths - 1, np.repeat(values, chunks))).astype(np.uint8).tobytes()
+
+
+def _reduce_colours(rgb):
+    # Frames with icons can have more colours than fit in a palette; LEDs won't show the difference
+    image = Image.fromarray(rgb).quantize(MAX_COLOURS, method=Image.Quantize.FASTOCTREE)
+    return np.asarray(image.convert("RGB"))
+
+
+class FrameEncoder:
+    """
+    Encodes one board's frames, each against the one before it. Returns None for a
+    frame that is identical to the last one sent, unless a keyframe is due.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.previous = None  # Packed pixels of the last frame sent, as the board decoded it
+        self.previous_brightness = None
+        self.seq = 0
+        self.last_keyframe = -float("inf")
+
+    def request_keyframe(self):
+        self.last_keyframe = -float("inf")
+
+    def encode(self, image, brightness=100):
+        rgb = np.asarray(image.convert("RGB"))
+        height, width, _ = rgb.shape
+        packed = _pack(rgb)
+
+        palette = np.unique(packed)
+        if len(palette) > MAX_COLOURS:
+            rgb = _reduce_colours(rgb)
+            packed = _pack(rgb)
+            palette = np.unique(packed)
+
+        keyframe_due = time.monotonic() - self.last_keyframe >= self.keyframe_interval
+        same_size = self.previous is not None and self.previous.shape == packed.shape
+        changed = None
+        if not keyframe_due and same_size and brightness == self.previous_brightness:
+            changed = packed != self.previous
+            if not changed.any():
+                return None
+            if changed.mean() > 0.5:
+                changed = None  # After a scene change a keyframe is as small, and resyncs the board too
+
+        if changed is not None:
+            # Only the colours of the pixels that changed are needed
+            palette = np.unique(packed[changed])
+            indices = np.full(packed.shape, KEEP, dtype=np.uint8)
+            indices[changed] = np.searchsorted(palette, packed[changed])
+            kind = DELTA
+        else:
+            indices = np.searchsorted(palette, packed)
+            kind = KEYFRAME
+            self.last_keyframe = time.monotonic()
+
+        self.seq = (self.seq + 1) % 65536
+        self.previous = packed
+        self.previous_brightness = brightness
+
+        header = HEADER.pack(MAGIC, kind, self.seq, width, height, brightness, len(palette))
+        return header + _unpack(palette).tobytes() + _runs(indices)
+
+
+class FrameDecoder:
+    """
+    Decodes a stream of frames from one FrameEncoder back into images.
+    """
+
+    def __init__(self):
+        self.previous = None  # RGB pixels of the last frame decoded
+        self.seq = None
+
+    def decode(self, payload):
+        """
+        Returns (image, brightness). Raises MissingFrame if a delta frame arrives
+        without the frame it builds on, and ValueError if the payload is corrupt.
+        """
+        magic, kind, seq, width, height, brightness, colours = HEADER.unpack_from(payload)
+        if magic != MAGIC:
+            raise ValueError("Not a frame")
+
+        palette_end = HEADER.size + colours * 3
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        palette[:colours] = np.frombuffer(payload, dtype=np.uint8, count=colours * 3, offset=HEADER.size).reshape(-1, 3)
+
+        runs = np.frombuffer(payload, dtype=np.uint8, offset=palette_end).reshape(-1, 2)
+        indices = np.repeat(runs[:, 1], runs[:, 0].astype(np.int32) + 1)
+        if len(indices) != width * height:
+            raise ValueError("Frame is the wrong size")
+
+        pixels = palette[indices]
+        if kind == DELTA:
+            base_ok = self.previous is not None and self.previous.shape == pixels.shape
+            if not base_ok or seq != (self.seq + 1) % 65536:
+                raise MissingFrame(f"Delta frame {seq} doesn't follow frame {self.seq}")
+            keep = indices == KEEP
+            pixels[keep] = self.previous[keep]
+
+        self.previous = pixels
+        self.seq = seq
+        return Image.fromarray(pixels.reshape(height, width, 3), "RGB"), brightness
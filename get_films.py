@@ -1,57 +1,42 @@
 import requests
-from bs4 import BeautifulSoup
 import json
+from collections import namedtuple
+from html.parser import HTMLParser
+from response_cache import cached_get
 
-def get_jamjar_films():
+# Use lxml when it is installed as it parses several times faster than html.parser
+try:
+    import lxml.etree
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+JAMJAR_URL = "https://www.jamjarcinema.com/now-playing"
+APP_ID = "q-app"
+
+# Pages are fed to the parser this many characters at a time, so it can stop at the
+# end of the app container without reading the rest
+CHUNK_SIZE = 16384
+
+# Elements that never have an end tag
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+Showtime = namedtuple("Showtime", ["time", "url"])  # time is "HH:MM", 24-hour
+Film = namedtuple("Film", ["title", "showtimes"])
+
+def get_jamjar_films(deadline=None):
     """
     Scrapes the 'Now Playing' page of Jam Jar Cinema to extract movie details
     from elements with the class 'movie-container'.
     """
-    url = "https://www.jamjarcinema.com/now-playing"
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     }
 
     try:
-        # Send a GET request to the URL
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        # Parse the HTML content of the page
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        movies = soup.find('div', id='q-app').find_all('a')
-
-        movie_data = {}
-
-        i = 0
-        while i < len(movies)-1:
-            url1 = movies[i].get('href')
-            url2 = movies[i+1].get('href')
-
-            if "/movie/" in url1 and "/checkout/" in url2:
-                title = movies[i].get_text(strip=True)
-                movie_data[title] = []
-
-                while "/checkout" in url2:
-                    time = movies[i+1].get_text(strip=True)
-                    if "PM" in time:
-                        time = time.replace("PM", "").split(":")
-                        if int(time[0]) == 12:
-                            time = f"12:{time[1]}"
-                        else:
-                            time = f"{int(time[0])+12}:{time[1]}"
-                    elif "AM" in time:
-                        time = time.replace("AM", "").split(":")
-                        time = f"{int(time[0]):02}:{time[1]}"
-                    movie_data[title].append(time)
-                    i += 1
-                    url2 = movies[i+1].get('href')
-
-            else:
-                i += 1
-
-        return movie_data
+        # Send a (conditional) GET request to the URL; the page is kept on disk for the next boot
+        response = cached_get("jamjar", JAMJAR_URL, headers=headers, timeout=15, deadline=deadline)
+        return parse_jamjar_films(response.body)
 
     except requests.exceptions.RequestException as e:
         print(f"Error fetching the URL: {e}")
@@ -60,6 +45,141 @@ def get_jamjar_films():
         print(f"An unexpected error occurred: {e}")
         return None
 
+def to_24_hour(text):
+    """
+    Converts a showtime like '7:30PM' or '11:00 AM' to '19:30' / '11:00'.
+    """
+    text = text.strip().upper()
+    suffix = text[-2:]
+    if suffix not in ("AM", "PM"):
+        return text
+
+    hours, minutes = text[:-2].strip().split(":")
+    hours = int(hours) % 12
+    if suffix == "PM":
+        hours += 12
+    return f"{hours:02}:{minutes}"
+
+class AppLinkParser(HTMLParser):
+    """
+    Streams through a page collecting (href, text) for each link inside the app
+    container, without building a tree for any of the page.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.found_app = False
+        self._depth = 0  # Open elements inside the app container
+        self._link = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth:
+            if tag not in VOID_ELEMENTS:
+                self._depth += 1
+            if tag == "a":
+                href = dict(attrs).get("href")
+                self._link = [href, []] if href else None
+        elif tag not in VOID_ELEMENTS and dict(attrs).get("id") == APP_ID:
+            self.found_app = True
+            self._depth = 1
+
+    def handle_endtag(self, tag):
+        if not self._depth:
+            return
+        if tag == "a" and self._link:
+            href, text = self._link
+            self.links.append((href, "".join(text)))
+            self._link = None
+        self._depth -= 1
+
+    def handle_data(self, data):
+        if self._link:
+            self._link[1].append(data.strip())
+
+    def done(self):
+        # The app container has been read to its end
+        return self.found_app and not self._depth
+
+def app_links(html):
+    """
+    Returns (href, text) for every link in the app container, in page order, or None
+    if the page has no app container.
+    """
+    if HTML_PARSER == "lxml":
+        return lxml_app_links(html)
+
+    parser = AppLinkParser()
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start:start + CHUNK_SIZE])
+        if parser.done():
+            return parser.links
+    parser.close()
+    return parser.links if parser.found_app else None
+
+def pull_events(parser, html):
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start:start + CHUNK_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+def lxml_app_links(html):
+    """
+    app_links() with lxml's pull parser, which is faster than AppLinkParser. Elements
+    before the app container are dropped as soon as they end, and parsing stops at
+    the end of the container.
+    """
+    links = []
+    found_app = False
+    depth = 0  # Open elements inside the app container
+
+    for event, element in pull_events(lxml.etree.HTMLPullParser(events=("start", "end")), html):
+        if depth:
+            if event == "start":
+                depth += 1
+                continue
+            if element.tag == "a" and element.get("href"):
+                links.append((element.get("href"), "".join(text.strip() for text in element.itertext())))
+            depth -= 1
+            if not depth:
+                return links
+        elif event == "start" and element.get("id") == APP_ID:
+            found_app = True
+            depth = 1
+        elif event == "end":
+            element.clear()
+
+    return links if found_app else None
+
+def parse_jamjar_films(html):
+    """
+    Extracts a list of Films from the 'Now Playing' page HTML. Each film link is
+    followed by the checkout links for its showtimes.
+    """
+    try:
+        links = app_links(html)
+        if links is None:
+            print("No listings found on the page.")
+            return None
+
+        films = {}
+        current = None
+
+        for href, text in links:
+            if "/movie/" in href:
+                current = text
+            elif "/checkout" in href and current:
+                films.setdefault(current, []).append(Showtime(to_24_hour(text), href))
+            else:
+                current = None
+
+        return [Film(title, tuple(showtimes)) for title, showtimes in films.items()]
+
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return None
+
 if __name__ == "__main__":
     print("Starting Jam Jar Cinema scraper...")
     films = get_jamjar_films()
@@ -67,7 +187,6 @@ if __name__ == "__main__":
     if films:
         print(f"\nSuccessfully extracted {len(films)} movies:")
         # Pretty print the extracted data
-        print(json.dumps(films, indent=4))
+        print(json.dumps({film.title: [s.time for s in film.showtimes] for film in films}, indent=4))
     else:
         print("\nFailed to extract movie data.")
-
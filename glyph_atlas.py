@@ -0,0 +1,177 @@
+import os
+import math
+import mmap
+import struct
+import glob
+from collections import OrderedDict
+from PIL import Image
+import metrics
+
+# Atlas file layout (little-endian):
+#   header:  magic, version, ascent, descent, glyph count
+#   table:   one entry per glyph, sorted by codepoint
+#   bitmaps: 1 bit per pixel, rows padded to a whole byte (the same packing as BDF)
+ATLAS_MAGIC = b"GATL"
+ATLAS_VERSION = 1
+HEADER = struct.Struct("<4sHhhI")
+GLYPH = struct.Struct("<IhhhHHI")  # codepoint, advance, x offset, y offset, width, height, bitmap offset
+
+MAX_CACHED_STRINGS = 256
+
+
+def compile_bdf(bdf_path, atlas_path):
+    """
+    Compiles a BDF font into an atlas file that can be memory-mapped at startup.
+    """
+    ascent = descent = 0
+    glyphs = []
+    glyph = None
+    rows = None
+
+    with open(bdf_path, encoding="latin-1") as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            keyword = parts[0]
+
+            if rows is not None:
+                if keyword == "ENDCHAR":
+                    glyph["bitmap"] = b"".join(rows)
+                    if glyph["codepoint"] >= 0:
+                        glyphs.append(glyph)
+                    glyph = rows = None
+                else:
+                    rows.append(bytes.fromhex(parts[0])[:(glyph["width"] + 7) // 8])
+            elif keyword == "FONT_ASCENT":
+                ascent = int(parts[1])
+            elif keyword == "FONT_DESCENT":
+                descent = int(parts[1])
+            elif keyword == "STARTCHAR":
+                glyph = {"codepoint": -1, "advance": 0, "width": 0, "height": 0, "x": 0, "y": 0}
+            elif keyword == "ENCODING":
+                glyph["codepoint"] = int(parts[-1])
+            elif keyword == "DWIDTH":
+                glyph["advance"] = int(parts[1])
+            elif keyword == "BBX":
+                glyph["width"], glyph["height"], glyph["x"], glyph["y"] = map(int, parts[1:5])
+            elif keyword == "BITMAP":
+                rows = []
+
+    glyphs.sort(key=lambda g: g["codepoint"])
+
+    table = bytearray()
+    bitmaps = bytearray()
+    for g in glyphs:
+        table += GLYPH.pack(g["codepoint"], g["advance"], g["x"], g["y"], g["width"], g["height"], len(bitmaps))
+        bitmaps += g["bitmap"]
+
+    tmp_path = atlas_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(ATLAS_MAGIC, ATLAS_VERSION, ascent, descent, len(glyphs)))
+        f.write(table)
+        f.write(bitmaps)
+    os.replace(tmp_path, atlas_path)
+
+    print(f"Compiled {bdf_path} ({len(glyphs)} glyphs) to {atlas_path}")
+
+
+class GlyphFont:
+    """
+    A bitmap font backed by a memory-mapped atlas. Strings are composed from the atlas
+    into a mask once and cached, so drawing a string again is a single paste.
+    """
+
+    def __init__(self, atlas_path):
+        with open(atlas_path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.ascent, self.descent, count = HEADER.unpack_from(self._data)
+        if magic != ATLAS_MAGIC or version != ATLAS_VERSION:
+            raise ValueError(f"{atlas_path} is not a version {ATLAS_VERSION} glyph atlas")
+
+        self.height = self.ascent + self.descent
+        self._bitmap_start = HEADER.size + count * GLYPH.size
+        table = self._data[HEADER.size:self._bitmap_start]
+        self._glyphs = {entry[0]: entry[1:] for entry in GLYPH.iter_unpack(table)}
+        self._default = self._glyphs.get(0) or self._glyphs.get(ord("?"))
+
+        self._glyph_masks = {}
+        self._strings = OrderedDict()
+        self._hits, self._misses = metrics.cache_counters("glyph_strings")
+
+    def _glyph(self, char):
+        return self._glyphs.get(ord(char), self._default)
+
+    def _glyph_mask(self, glyph):
+        mask = self._glyph_masks.get(glyph)
+        if mask is None:
+            _, _, _, width, height, offset = glyph
+            start = self._bitmap_start + offset
+            size = (width + 7) // 8 * height
+            mask = Image.frombytes("1", (width, height), self._data[start:start + size])
+            self._glyph_masks[glyph] = mask
+        return mask
+
+    def getlength(self, text):
+        return sum(self._glyph(char)[0] for char in text)
+
+    def getmask(self, text):
+        """
+        Returns (x offset, mask) for a string; the mask's left edge is drawn at x + offset.
+        """
+        cached = self._strings.get(text)
+        if cached is not None:
+            self._strings.move_to_end(text)
+            self._hits.inc()
+            return cached
+        self._misses.inc()
+
+        glyphs = [self._glyph(char) for char in text]
+
+        # Glyphs may draw left of their origin, so find how far the string reaches
+        left, right, pen = 0, 0, 0
+        for advance, x, _, width, _, _ in glyphs:
+            left = min(left, pen + x)
+            right = max(right, pen + x + width, pen + advance)
+            pen += advance
+
+        mask = Image.new("L", (max(right - left, 1), self.height), 0)
+        pen = -left
+        for glyph in glyphs:
+            advance, x, y, width, height, _ = glyph
+            if width and height:
+                mask.paste(255, (pen + x, self.ascent - y - height), self._glyph_mask(glyph))
+            pen += advance
+
+        cached = (left, mask)
+        self._strings[text] = cached
+        if len(self._strings) > MAX_CACHED_STRINGS:
+            self._strings.popitem(last=False)
+        return cached
+
+    def draw(self, image, xy, text, fill):
+        offset, mask = self.getmask(text)
+        # Round fractional positions the same way ImageDraw.text does
+        x, y = math.floor(xy[0] + 0.5) + offset, math.ceil(xy[1] - 0.5)
+        image.paste(fill, (x, y, x + mask.width, y + mask.height), mask)
+
+
+def load_font(bdf_path):
+    """
+    Loads the atlas for a BDF font, compiling it first if it is missing or out of date.
+    """
+    atlas_path = os.path.splitext(bdf_path)[0] + ".atlas"
+    if not os.path.exists(atlas_path) or os.path.getmtime(atlas_path) < os.path.getmtime(bdf_path):
+        compile_bdf(bdf_path, atlas_path)
+    return GlyphFont(atlas_path)
+
+
+def draw_text(image, xy, text, font, fill):
+    font.draw(image, xy, text, fill)
+
+
+if __name__ == "__main__":
+    # Build step: compile every BDF font next to this script
+    for bdf_path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.bdf"))):
+        compile_bdf(bdf_path, os.path.splitext(bdf_path)[0] + ".atlas")
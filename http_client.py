@@ -0,0 +1,152 @@
+import time
+import random
+import threading
+import requests
+from urllib.parse import urlparse
+import metrics
+
+# Every request to an upstream goes through get(), which keeps a circuit breaker per
+# host. After a few failures in a row the host isn't tried again until a backoff has
+# passed, so a dead upstream costs one request per backoff rather than a timeout on
+# every fetch. The backoff doubles, with jitter, each time a trial request fails.
+FAILURES_TO_OPEN = 3
+MIN_BACKOFF = 5  # Seconds
+MAX_BACKOFF = 300
+
+# Shared so requests to the same upstream reuse a kept-alive connection
+session = requests.Session()
+
+# Called with the upstream's name whenever a request gets any response, e.g. so the
+# network monitor knows the link works
+on_response = None
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """
+    Raised instead of making a request to a host whose circuit breaker is open.
+    """
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised when there is no time left in a request's deadline to make it.
+    """
+
+
+class CircuitBreaker:
+    """
+    Closed while requests succeed. Opens after FAILURES_TO_OPEN failures in a row, then
+    once its backoff has passed lets a single trial request through: if that succeeds it
+    closes again, otherwise it opens for twice as long.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.backoff = MIN_BACKOFF
+        self.open_until = None  # time.monotonic() the breaker is open until, or None if closed
+        self.trial = False  # A trial request is in flight
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self.open_until is not None
+
+    def allow(self):
+        with self._lock:
+            if self.open_until is None:
+                return True
+            if self.trial or time.monotonic() < self.open_until:
+                return False
+            self.trial = True
+            return True
+
+    def succeeded(self):
+        with self._lock:
+            if self.open_until is not None:
+                print(f"Circuit for {self.name} closed")
+            self.failures = 0
+            self.backoff = MIN_BACKOFF
+            self.open_until = None
+            self.trial = False
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial:
+                self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+            elif self.failures < FAILURES_TO_OPEN:
+                return
+
+            self.trial = False
+            # Jitter so boards that lost an upstream at the same moment don't retry together
+            wait = self.backoff * random.uniform(0.5, 1)
+            self.open_until = time.monotonic() + wait
+            print(f"Circuit for {self.name} open for {wait:.0f}s after {self.failures} failures")
+
+
+_breakers = {}  # host -> CircuitBreaker
+_lock = threading.Lock()
+
+
+def breaker(host):
+    with _lock:
+        if host not in _breakers:
+            name = metrics.UPSTREAMS.get(host, host)
+            circuit = _breakers[host] = CircuitBreaker(name)
+            metrics.registry.gauge("circuit_open", "Whether each upstream's circuit breaker is open", fn=lambda: int(circuit.is_open()), upstream=name)
+        return _breakers[host]
+
+
+def _fit_timeout(timeout, deadline):
+    # Cuts (connect, read) or single timeouts down to the time left before `deadline`
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("No time left before the deadline")
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+
+def _is_upstream_fault(error):
+    # Timeouts, connection errors and 5xx/429 responses; other 4xx errors are ours
+    response = getattr(error, "response", None)
+    return response is None or response.status_code >= 500 or response.status_code == 429
+
+
+def get(url, session=session, timeout=10, deadline=None, **kwargs):
+    """
+    GETs `url` and raises for an error status. `deadline` is an optional
+    time.monotonic() by which the request has to be finished; the timeout is cut to
+    fit. Raises CircuitOpen without making a request while the host is backing off.
+    """
+    timeout = _fit_timeout(timeout, deadline)
+    circuit = breaker(urlparse(url).hostname)
+    if not circuit.allow():
+        metrics.registry.counter("circuit_rejected_total", "Requests not made as the upstream's circuit was open", upstream=circuit.name).inc()
+        raise CircuitOpen(f"Circuit for {circuit.name} is open")
+
+    start = time.monotonic()
+    try:
+        response = session.get(url, timeout=timeout, **kwargs)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        metrics.record_request(url, time.monotonic() - start, e)
+        if getattr(e, "response", None) is not None:
+            _responded(circuit)
+        if _is_upstream_fault(e):
+            circuit.failed()
+        else:
+            circuit.succeeded()  # The host answered
+        raise
+
+    metrics.record_request(url, time.monotonic() - start)
+    _responded(circuit)
+    circuit.succeeded()
+    return response
+
+
+def _responded(circuit):
+    if on_response:
+        on_response(circuit.name)
@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+import http_client
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+import metrics
+
+# Resized icons are kept on disk so they survive restarts, and the most recently
+# used ones are kept decoded in memory so rendering never touches the network.
+ICON_CACHE_DIR = "icon_cache"
+MAX_MEMORY_ICONS = 32
+DEFAULT_ICON_SIZE = (24, 24)
+
+_weather_icons = None  # Loaded the first time an icon is needed, not at boot
+
+_memory_icons = OrderedDict()
+_lock = threading.Lock()
+_hits, _misses = metrics.cache_counters("icons")
+
+
+def weather_icons():
+    global _weather_icons
+    if _weather_icons is None:
+        with open("weather_icons.json") as f:
+            _weather_icons = json.load(f)
+    return _weather_icons
+
+
+def _icon_url(code, is_daytime):
+    time_of_day = "day" if is_daytime else "night"
+    return weather_icons().get(str(code), {}).get(time_of_day, {}).get("image")
+
+
+def _disk_path(icon_url, icon_size):
+    # Several weather codes share an image, so store by image name rather than code
+    name = os.path.splitext(os.path.basename(icon_url))[0]
+    return os.path.join(ICON_CACHE_DIR, f"{name}_{icon_size[0]}x{icon_size[1]}.png")
+
+
+def _remember(key, icon):
+    with _lock:
+        _memory_icons[key] = icon
+        _memory_icons.move_to_end(key)
+        while len(_memory_icons) > MAX_MEMORY_ICONS:
+            _memory_icons.popitem(last=False)
+
+
+def get_icon(code, is_daytime, icon_size=DEFAULT_ICON_SIZE):
+    """
+    Returns the resized RGBA icon for a weather code from memory or disk, or None if it
+    hasn't been downloaded yet. Never makes a network request.
+    """
+    key = (str(code), bool(is_daytime), tuple(icon_size))
+    with _lock:
+        icon = _memory_icons.get(key)
+        if icon is not None:
+            _memory_icons.move_to_end(key)
+            _hits.inc()
+            return icon
+    _misses.inc()
+
+    icon_url = _icon_url(code, is_daytime)
+    if not icon_url:
+        print("No icon found for this weather code.")
+        return None
+
+    path = _disk_path(icon_url, icon_size)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with Image.open(path) as f:
+            icon = f.convert("RGBA")
+    except Exception as e:
+        print(f"Error loading icon: {e}")
+        return None
+
+    _remember(key, icon)
+    return icon
+
+
+def download_icon(code, is_daytime, icon_size=DEFAULT_ICON_SIZE, deadline=None):
+    icon_url = _icon_url(code, is_daytime)
+    if not icon_url:
+        return False
+
+    path = _disk_path(icon_url, icon_size)
+    if os.path.exists(path):
+        return True
+
+    try:
+        response = http_client.get(icon_url, timeout=10, deadline=deadline)
+        icon = Image.open(BytesIO(response.content)).convert("RGBA").resize(icon_size)
+    except (http_client.CircuitOpen, http_client.DeadlineExceeded):
+        raise  # Every other icon would fail the same way
+    except Exception as e:
+        print(f"Error downloading icon: {e}")
+        return False
+
+    os.makedirs(ICON_CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first so a power cut can't leave a half-written icon
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    icon.save(tmp_path, "PNG")
+    os.replace(tmp_path, path)
+
+    _remember((str(code), bool(is_daytime), tuple(icon_size)), icon)
+    return True
+
+
+def warm_icons(codes=None, icon_size=DEFAULT_ICON_SIZE, deadline=None):
+    """
+    Downloads any icons missing from the disk cache. With no `codes`, every entry in
+    weather_icons.json is fetched. Stops early if the icon host's circuit opens or the
+    optional `deadline` passes. Returns the number of icons that are available.
+    """
+    if codes is None:
+        codes = weather_icons().keys()
+
+    available = 0
+    for code in codes:
+        for is_daytime in (True, False):
+            try:
+                if download_icon(code, is_daytime, icon_size, deadline):
+                    available += 1
+            except (http_client.CircuitOpen, http_client.DeadlineExceeded) as e:
+                print("Stopped downloading icons:", e)
+                return available
+    return available
@@ -0,0 +1,137 @@
+import time
+from datetime import date
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from fetchers import Snapshot
+from get_films import get_jamjar_films, parse_jamjar_films
+import response_cache
+
+# One film at one cinema. `showtimes` are get_films.Showtime tuples in time order.
+Listing = namedtuple("Listing", ["title", "cinema", "showtimes"])
+
+
+class Provider:
+    """
+    A source of today's cinema listings. Subclasses set `name` and implement
+    fetch(deadline), returning a list of get_films.Film, or None if the fetch failed.
+    `deadline` is a time.monotonic() to give up by, or None. `timeout` is how long, in
+    seconds, a refresh waits for this provider before using its cached films.
+    """
+
+    name = None
+    timeout = 15
+
+    def fetch(self, deadline=None):
+        raise NotImplementedError
+
+    def load_cached(self):
+        # A Snapshot of the films stored by the last boot, or None
+        return None
+
+
+class JamJarProvider(Provider):
+    name = "Jam Jar"
+
+    def fetch(self, deadline=None):
+        return get_jamjar_films(deadline)
+
+    def load_cached(self):
+        cached = response_cache.load("jamjar")
+        return cached and Snapshot(parse_jamjar_films(cached.body), cached.fetched_at)
+
+
+class Listings:
+    """
+    Fetches every provider at the same time and merges their films. Each provider's
+    last good films are kept separately, so a slow or failing site only means its
+    own listings are out of date.
+    """
+
+    def __init__(self, providers):
+        self.providers = providers
+        self._films = {}  # provider name -> Snapshot of its last good films
+        self._pending = {}  # provider name -> Future of a fetch still running
+        self._executor = ThreadPoolExecutor(max_workers=max(len(providers), 1), thread_name_prefix="listings")
+
+    def _fetch_provider(self, provider, deadline):
+        start = time.monotonic()
+        try:
+            films = provider.fetch(deadline)
+        except Exception as e:
+            print(f"Error fetching {provider.name} listings:", e)
+            films = None
+
+        status = "ok" if films is not None else "failed"
+        print(f"Listings {provider.name}: {(time.monotonic() - start) * 1000:.0f}ms ({status})")
+
+        # A result that arrives after the deadline is still kept for the next refresh
+        if films is not None:
+            self._films[provider.name] = Snapshot(films, time.time())
+        return films is not None
+
+    def load_cached(self):
+        for provider in self.providers:
+            try:
+                snapshot = provider.load_cached()
+            except Exception as e:
+                print(f"Error loading cached {provider.name} listings:", e)
+                continue
+            if snapshot and snapshot.data is not None:
+                self._films.setdefault(provider.name, snapshot)
+
+        if not self._films:
+            return None
+        return Snapshot(self.merged(), min(s.timestamp for s in self._films.values()))
+
+    def fetch(self, deadline=None):
+        """
+        Refreshes every provider, waiting for each one up to its own timeout or the
+        optional time.monotonic() `deadline`. Returns the merged listings, or None if
+        every provider failed, so the caller knows the films it has are out of date.
+        """
+        start = time.monotonic()
+        refreshed = False
+        for provider in self.providers:
+            # Don't pile up requests behind a provider that still hasn't answered
+            if provider.name not in self._pending:
+                self._pending[provider.name] = self._executor.submit(self._fetch_provider, provider, deadline)
+
+        for provider in self.providers:
+            future = self._pending[provider.name]
+            wait_until = start + provider.timeout if deadline is None else min(start + provider.timeout, deadline)
+            try:
+                refreshed = future.result(timeout=max(wait_until - time.monotonic(), 0)) or refreshed
+            except TimeoutError:
+                print(f"Listings {provider.name}: no response in time, using cached films")
+                continue
+            del self._pending[provider.name]
+
+        if not refreshed:
+            return None
+        return self.merged()
+
+    def merged(self):
+        # Each provider's films are only today's showtimes on the day they were fetched
+        listings = []
+        for provider in self.providers:
+            snapshot = self._films.get(provider.name)
+            if snapshot is None or date.fromtimestamp(snapshot.timestamp) != date.today():
+                continue
+            for film in snapshot.data:
+                listings.append(Listing(film.title, provider.name, tuple(sorted(film.showtimes))))
+        return upcoming(listings, "00:00")
+
+
+def upcoming(listings, now):
+    """
+    Drops showtimes that started before `now` ("HH:MM") and films with none left,
+    sorted by next showing.
+    """
+    result = []
+    for listing in listings:
+        showtimes = tuple(s for s in listing.showtimes if s.time >= now)
+        if showtimes:
+            result.append(listing._replace(showtimes=showtimes))
+
+    result.sort(key=lambda listing: (listing.showtimes[0].time, listing.title))
+    return result
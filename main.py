@@ -1,48 +1,108 @@
+import time
+BOOT_STARTED = time.monotonic()  # Boot stages are timed from here
+
 import os
 import json
+import queue
+import struct
 import threading
-import requests
-from PIL import Image, ImageDraw, ImageFont
-from rgbmatrix import RGBMatrix, RGBMatrixOptions
+from PIL import Image, ImageDraw
 from signal import pause
+from dotenv import load_dotenv
+load_dotenv()  # Load environment variables from .env file, before display.py reads its own
+from display import FramePresenter, DisplayProcess, create_matrix, DISPLAY_BACKEND, DISPLAY_PROCESS
+if DISPLAY_BACKEND != "matrix":
+    # Off the Pi, the button and LED use gpiozero's simulated pins
+    os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
 from gpiozero import LED, Button
-from datetime import datetime
-import time
-from io import BytesIO
+from datetime import datetime, date
+from collections import namedtuple
 import paho.mqtt.client as mqtt
 import ssl
-from dotenv import load_dotenv
 import subprocess
 import qrcode
 import warnings
-import textwrap
-from flask import Flask, render_template, request, redirect, url_for
-from get_films import get_jamjar_films
+from flask import Flask, Response, render_template, request, redirect, url_for
+from fetchers import Fetcher
+from metro import get_platform_times, get_stations, cached_stations, DepartureTracker, upcoming, minutes_until
+from icon_cache import get_icon, warm_icons
+from glyph_atlas import load_font, draw_text
+from marquee import Marquee
+from pacing import FramePacer, WakeEvent
+from forecast import Forecast
+from fetchers import Snapshot
+import response_cache
+import http_client
+from message_store import MessageStore
+from message_layout import MessagePages
+from listings import Listings, JamJarProvider, upcoming as upcoming_films
+import metrics
+from frame_codec import FrameDecoder, MissingFrame, KEYFRAME_INTERVAL
+from netmon import NetworkMonitor, PROBE_INTERVAL
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 # SETUP VARIABLES
-load_dotenv()  # Load environment variables from .env file
-
 client = None 
 mqtt_connected = threading.Event()
 
 MQTT_BROKER = os.getenv("MQTT_BROKER")
-MQTT_PORT = int(os.getenv("MQTT_PORT"))
+MQTT_PORT = int(os.getenv("MQTT_PORT", 8883))
 BOARD_ID = os.getenv("BOARD_ID")
 MQTT_USERNAME = os.getenv("MQTT_USERNAME")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 
+# "local" fetches and renders everything on the board, "remote" only displays frames
+# rendered by a render server
+FRAME_SOURCE = os.getenv("FRAME_SOURCE", "local")
+
+# "threads" runs each part of the board on its own thread, "asyncio" runs MQTT, fetch
+# scheduling and rendering on one event loop (see async_runtime.py)
+RUNTIME = os.getenv("RUNTIME", "threads")
+
+# Keep the next mode's data fetched and a frame of it rendered, so the button shows it at once.
+# The next mode's fetcher polls as if it were on screen, so this roughly doubles the
+# requests made to the upstreams; PRERENDER=0 only fetches for the mode on screen.
+PRERENDER = os.getenv("PRERENDER", "1") == "1"
+
 MODES = ["clock", "messages", "metro", "weather", "weather_graph", "films", "link", "off"]
+
+# Target seconds between frames in each mode. None means only redraw when woken by update_event.
+FRAME_INTERVALS = {
+    "clock": 1,
+    "messages": 15,
+    "metro": 1,  # Departures count down locally between polls
+    "weather": 30,
+    "weather_graph": 30,
+    "films": 0.08,
+    "link": None,
+    "off": None,
+    "wifi_setup": None
+}
 current_mode = 0
-force_refresh_messages = False
+mode_switched_at = None  # When the mode change not yet on screen was asked for
+
+# LED Matrix setup (set DISPLAY_BACKEND to run without one, see display.py)
+if DISPLAY_PROCESS:
+    # The panel is driven from its own process; this one only needs to know its size
+    # and brightness
+    matrix = create_matrix("null")
+    presenter = DisplayProcess(matrix)
+    if __name__ == '__main__':
+        presenter.start()  # Before gpiozero starts its threads, and any of ours
+else:
+    matrix = create_matrix()
+    presenter = FramePresenter(matrix)
 
 # Setup button and LED
 button = Button(21, bounce_time=0.2)  # 200 ms debounce time
 led = LED(26)
 
 SETTINGS_FILE = "settings.json"
-update_event = threading.Event()
+update_event = WakeEvent()
+
+# Mode changes from the button and MQTT, applied by the render loop so only it writes current_mode
+mode_events = queue.SimpleQueue()
 
 # Default settings
 default_settings = {
@@ -60,29 +120,21 @@ if not os.path.exists(SETTINGS_FILE):
     with open(SETTINGS_FILE, "w") as f:
         json.dump(default_settings, f)
 
-# LED Matrix setup
-options = RGBMatrixOptions()
-options.rows = 48
-options.cols = 96
-options.chain_length = 1
-options.parallel = 1
-options.hardware_mapping = 'regular'
-options.brightness = 100
-options.pwm_lsb_nanoseconds = 130
-options.pwm_bits = 11
-options.gpio_slowdown = 2
-options.disable_hardware_pulsing = True
-
-matrix = RGBMatrix(options=options)
+metrics.registry.counter("frames_pushed_total", "Frames sent to the panel", fn=lambda: presenter.frames_pushed)
+metrics.registry.counter("frames_skipped_total", "Frames identical to the one on the panel", fn=lambda: presenter.frames_skipped)
+
+# How often a compact metrics snapshot is published on the status topic, in seconds
+METRICS_INTERVAL = 60
 
+# Fonts are loaded from precompiled glyph atlases (run `python glyph_atlas.py` to build them)
 font_size = 8
-font = ImageFont.truetype("./5x8.bdf", font_size)
+font = load_font("./5x8.bdf")
 
 smallFontHeight = 6
-smallFont = ImageFont.truetype("./4x6.bdf", smallFontHeight)
+smallFont = load_font("./4x6.bdf")
 
 largeFontHeight = 20
-largeFont = ImageFont.truetype("./10x20.bdf", largeFontHeight)
+largeFont = load_font("./10x20.bdf")
 
 primaryColour = (246, 115, 25)
 secondaryColour = (6, 234, 49)
@@ -90,23 +142,16 @@ secondaryColour = (6, 234, 49)
 rainColour = (33, 227, 253)
 tempColour = (252, 238, 70)
 uvColour = (253, 72, 34)
+staleColour = (255, 0, 0)
 
 
 # FUNCTIONS:
 
-# Check if Pi is connected to Wi-Fi
-def check_wifi():
-    try:
-        subprocess.check_call(['ping', '-c', '1', '8.8.8.8'])
-        return True
-    except subprocess.CalledProcessError:
-        return False
-
-# Create an access point for Wi-Fi setup
+# Create an access point for Wi-Fi setup. dhcpcd is only stopped, not disabled, so a
+# reboot always tries the client network first.
 def create_access_point():
     subprocess.call(['sudo', 'systemctl', 'stop', 'dhcpcd.service'])
-    subprocess.call(['sudo', 'systemctl', 'disable', 'dhcpcd.service'])
-    
+
     # Set up the access point using hostapd and dnsmasq
     subprocess.call(['sudo', 'systemctl', 'start', 'hostapd.service'])
     subprocess.call(['sudo', 'systemctl', 'start', 'dnsmasq.service'])
@@ -124,12 +169,10 @@ def set_wifi_credentials(ssid, password):
     subprocess.call(['sudo', 'reboot'])
 
 # Display QR code for Wi-Fi setup
-def display_qr_code():
+def showWifiSetup():
     wifi_setup_url = "http://localhost:5000"  # URL for the Flask app
     qr = qrcode.make(wifi_setup_url)
-    img = qr.resize((min(matrix.width, matrix.height),min(matrix.width, matrix.height)))
-    matrix.SetImage(img.convert('RGB'))
-    time.sleep(10)
+    return qr.resize((min(matrix.width, matrix.height),min(matrix.width, matrix.height)))
 
 # Load settings
 def load_settings():
@@ -138,11 +181,16 @@ def load_settings():
 
 def on_connect(client, userdata, flags, rc):
     print("Connected to MQTT broker with result code", rc)
+    if rc != 0:
+        return
     client.subscribe(f"boards/{BOARD_ID}/#")
+    if not mqtt_connected.is_set():
+        boot_stage("mqtt_connected")
     mqtt_connected.set()
+    if FRAME_SOURCE == "remote":
+        request_frames()
 
 def on_message(client, userdata, msg):
-    global current_mode, force_refresh_messages
     print(f"MQTT message received on topic {msg.topic}")
     if msg.topic == f"boards/{BOARD_ID}/settings":
         try:
@@ -160,10 +208,54 @@ def on_message(client, userdata, msg):
         except Exception as e:
             print("Failed to apply MQTT settings:", e)
 
+    elif msg.topic == f"boards/{BOARD_ID}/messages/snapshot":
+        try:
+            payload = json.loads(msg.payload.decode())
+            message_store.apply_snapshot(payload["messages"], payload.get("seq"))
+        except Exception as e:
+            print("Failed to apply messages snapshot:", e)
+
+    elif msg.topic == f"boards/{BOARD_ID}/messages/delta":
+        try:
+            if not message_store.apply_delta(json.loads(msg.payload.decode())):
+                print("Missed or couldn't apply a messages update, resyncing")
+                messages_fetcher.refresh()
+        except Exception as e:
+            print("Failed to apply messages update:", e)
+
+    elif msg.topic == f"boards/{BOARD_ID}/frame":
+        receive_frame(msg.payload)
+
+    elif msg.topic == f"boards/{BOARD_ID}/mode":
+        mode = msg.payload.decode()
+        if mode in MODES:
+            set_mode(mode)
+        else:
+            print("Unknown mode:", mode)
+
     elif msg.topic == f"boards/{BOARD_ID}/message":
-        if MODES[current_mode] == "messages":
-            force_refresh_messages = True
-            update_event.set()
+        # Only says that messages changed, so fetch them over HTTP
+        message_store.needs_resync = True
+        messages_fetcher.refresh()
+
+
+def publish_metrics():
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        publish_status()
+
+
+def publish_status():
+    if client is None or not client.is_connected():
+        return
+    try:
+        status = {
+            "mode": MODES[current_mode],
+            "metrics": metrics.registry.snapshot()
+        }
+        client.publish(f"board/{BOARD_ID}/status", json.dumps(status, separators=(",", ":")))
+    except Exception as e:
+        print("Failed to publish metrics:", e)
 
 
 def run_mqtt():
@@ -175,9 +267,10 @@ def run_mqtt():
     client.on_message = on_message
     client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
     try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        print(f"connected to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
-        client.loop_forever()
+        # Keeps trying in the background if the broker is slow or unreachable; the board
+        # runs on cached data until it connects
+        client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_forever(retry_first_connection=True)
     except Exception as e:
         print("MQTT connection error:", e)
 
@@ -207,25 +300,72 @@ def save_settings(station1, platform1, station2, platform2, lat, lon, forecast_h
 
     settings = load_settings()
 
+    # Data for the old stations/location is no longer wanted
+    metro_fetcher.refresh()
+    weather_fetcher.refresh()
+
     update_event.set()  # Notify display thread of changes
 
-def get_trains(station, platform):
+stations = {}  # Station code -> name
+
+def refresh_stations():
+    global stations
     try:
-        response = requests.get(f"https://metro-rti.nexus.org.uk/api/times/{station}/{platform}")
-        return json.loads(response.text)[:2]
-    except:
-        return []
+        stations = get_stations()
+    except Exception as e:
+        print("Error fetching stations:", e)
+
 
 def convertStationCode(code):
     return stations.get(code, "Unknown")
 
 
 def cycle_mode():
-    global current_mode
-    current_mode = (current_mode + 1) % len(MODES)
-    print(f"Switched to mode: {MODES[current_mode]}")
+    mode_events.put((None, time.monotonic()))  # None means the next mode
+    update_event.set()
+
+
+def set_mode(mode):
+    mode_events.put((mode, time.monotonic()))
     update_event.set()
 
+
+def next_mode():
+    return MODES[(current_mode + 1) % len(MODES)]
+
+
+def apply_mode_events():
+    """
+    Applies the mode changes queued since the last frame. Returns True if the mode changed.
+    """
+    global current_mode, mode_switched_at
+    previous = current_mode
+    asked_at = None
+    while True:
+        try:
+            mode, asked_at = mode_events.get_nowait()
+        except queue.Empty:
+            break
+        current_mode = (current_mode + 1) % len(MODES) if mode is None else MODES.index(mode)
+        if mode_switched_at is None:
+            mode_switched_at = asked_at
+
+    if current_mode == previous:
+        return False
+    print(f"Switched to mode: {MODES[current_mode]}")
+    for fetcher in fetchers:
+        fetcher.poke()
+    return True
+
+
+def mode_switch_shown(frame):
+    # Records how long the last mode change took to reach the panel, and with what frame
+    global mode_switched_at
+    if mode_switched_at is None:
+        return
+    metrics.registry.histogram("button_to_pixel_seconds", "Time from a mode change being asked for to its first frame", frame=frame).observe(time.monotonic() - mode_switched_at)
+    mode_switched_at = None
+
 # Button setup to toggle screen on/off
 button.when_pressed = cycle_mode
 
@@ -243,6 +383,10 @@ def setup_wifi():
         return redirect(url_for('departure_board'))
     return render_template('setup.html')
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.prometheus(), mimetype="text/plain; version=0.0.4")
+
 def run_flask():
     app.run(host='0.0.0.0', port=5000)
 
@@ -250,23 +394,28 @@ def run_flask():
 
 # DISPLAY FUNCTIONS:
 def showMetro():
-    station_code1, platform1 = settings['station1'], settings['platform1']
-    station_code2, platform2 = settings['station2'], settings['platform2']
+    snapshot = metro_fetcher.latest()
+    if not snapshot:
+        return None
+
+    # Count down locally from the expected times rather than showing each poll's minutes
+    now = time.time()
+    times1, times2 = snapshot.data
+    station_code1, platform1, trains1 = times1.station, times1.platform, upcoming(times1.trains, now)[:2]
+    station_code2, platform2, trains2 = times2.station, times2.platform, upcoming(times2.trains, now)[:2]
 
     lowestPixel = 1
-    trains1, trains2 = get_trains(station_code1, platform1), get_trains(station_code2, platform2)
-    print("Fetched trains")
     
     image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
     draw = ImageDraw.Draw(image)
     
     # Draw station and platform
-    draw.text((1, lowestPixel), f"{convertStationCode(station_code1)}: {platform1}", font=smallFont, fill=secondaryColour)
+    draw_text(image, (1, lowestPixel), f"{convertStationCode(station_code1)}: {platform1}", smallFont, secondaryColour)
     lowestPixel += smallFontHeight
 
     # Draw train departures
     for i, train in enumerate(trains1):
-        destination = train['destination']
+        destination = train.destination
         if len(destination) > 15:
             displayFont = smallFont
             if i == 0:
@@ -275,31 +424,28 @@ def showMetro():
             displayFont = font
 
         text_position = (1, lowestPixel)
-        draw.text(text_position, destination, font=displayFont, fill=primaryColour)
+        draw_text(image, text_position, destination, displayFont, primaryColour)
         
-        due = str(train['dueIn'])
-        if due == "0":
-            due = "Due"
-        elif due == "-1":
-            due = "Due"
+        minutes = minutes_until(train, now)
+        due = str(minutes) if minutes > 0 else "Due"
             
         if len(destination) > 15:
             text_position = (matrix.width-5*len(due), lowestPixel-1)
         else:
             text_position = (matrix.width-5*len(due), lowestPixel)
             
-        draw.text(text_position, due, font=font, fill=primaryColour)
+        draw_text(image, text_position, due, font, primaryColour)
 
         lowestPixel += font_size
         
     if len(trains1) == 0:
         lowestPixel += 2
         text = "There are no services"
-        draw.text((int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, font=smallFont, fill=primaryColour)
+        draw_text(image, (int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, smallFont, primaryColour)
         lowestPixel += smallFontHeight+1
         
         text = "from this platform"
-        draw.text((int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, font=smallFont, fill=primaryColour)
+        draw_text(image, (int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, smallFont, primaryColour)
 
     # Draw Line Separator:
     lowestPixel = 24
@@ -309,11 +455,11 @@ def showMetro():
     draw.line(line_position, fill=primaryColour, width=1)
 
     # Display 2nd info:
-    draw.text((1, lowestPixel), f"{convertStationCode(station_code2)}: {platform2}", font=smallFont, fill=secondaryColour)
+    draw_text(image, (1, lowestPixel), f"{convertStationCode(station_code2)}: {platform2}", smallFont, secondaryColour)
     lowestPixel += smallFontHeight
 
     for i, train in enumerate(trains2):
-        destination = train['destination']
+        destination = train.destination
         if len(destination) > 15:
             displayFont = smallFont
             if i == 0:
@@ -322,138 +468,109 @@ def showMetro():
             displayFont = font
 
         text_position = (1, lowestPixel)
-        draw.text(text_position, destination, font=displayFont, fill=primaryColour)
+        draw_text(image, text_position, destination, displayFont, primaryColour)
 
-        due = str(train['dueIn'])
-        if due == "0":
-            due = "Due"
-        elif due == "-1":
-            due = "Due"
+        minutes = minutes_until(train, now)
+        due = str(minutes) if minutes > 0 else "Due"
 
         if len(destination) > 15:
             text_position = (matrix.width-5*len(due), lowestPixel-1)
         else:
             text_position = (matrix.width-5*len(due), lowestPixel)
 
-        draw.text(text_position, due, font=font, fill=primaryColour)
+        draw_text(image, text_position, due, font, primaryColour)
 
         lowestPixel += font_size
 
     if len(trains2) == 0:
         lowestPixel += 2
         text = "There are no services"
-        draw.text((int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, font=smallFont, fill=primaryColour)
+        draw_text(image, (int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, smallFont, primaryColour)
         lowestPixel += smallFontHeight+1
 
         text = "from this platform"
-        draw.text((int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, font=smallFont, fill=primaryColour)
+        draw_text(image, (int(matrix.width/2-(len(text)*4/2)), lowestPixel), text, smallFont, primaryColour)
 
     return image
 
 
-weather_cache = {
-    "timestamp": 0,
-    "lat": "",
-    "lon": "",
-    "data": None
-}
-
-last_forecast_data = None
+last_forecast = None
+last_icons = None
 last_rendered_image = None
 
-with open("weather_icons.json") as f:
-    weather_icons = json.load(f)
+# Replaced whenever icons have been downloaded, so weather frames drawn without them are redrawn
+icons_version = object()
 
 
-def get_icon(code, is_daytime, icon_size):
-    time_of_day = "day" if is_daytime else "night"
-    icon_url = weather_icons.get(str(code), {}).get(time_of_day, {}).get("image")
-    if not icon_url:
-        print("No icon found for this weather code.")
-        return None
+def warm_weather_icons():
+    # At boot: the forecast may have come from the cache before its icons were downloaded
+    global icons_version
+    warm_icons()
+    icons_version = object()
+    wake_if_showing("weather")()
 
-    try:
-        response = requests.get(icon_url)
-        icon = Image.open(BytesIO(response.content)).convert("RGBA")
-        return icon.resize(icon_size)
-    except Exception as e:
-        print(f"Error loading icon: {e}")
-        return None
+def weather_cache_name(lat=None, lon=None):
+    lat = settings['lat'] if lat is None else lat
+    lon = settings['lon'] if lon is None else lon
+    return f"weather_{lat}_{lon}"
 
 
-def get_weather_forecast():
-    global weather_cache
-    global settings
-
-    now = time.time()
-    if weather_cache["data"] and now - weather_cache["timestamp"] < 600 and weather_cache["lon"] == settings["lon"] and weather_cache["lat"] == settings["lat"]:
-        return weather_cache["data"]
-    
-    print("Fetching new weather data")
-
+def weather_url(lat, lon):
     today = datetime.now().date()
     start = today.strftime("%Y-%m-%dT00:00")
     end = today.strftime("%Y-%m-%dT23:00")
 
-    url = (
+    return (
         f"https://api.open-meteo.com/v1/forecast?"
-        f"latitude={settings['lat']}&longitude={settings['lon']}"
+        f"latitude={lat}&longitude={lon}"
         f"&hourly=temperature_2m,precipitation_probability,weathercode,uv_index,is_day"
         f"&start={start}&end={end}"
         f"&timezone=Europe%2FLondon"
     )
 
+
+def get_weather_forecast(deadline=None):
+    print("Fetching new weather data")
+
+    url = weather_url(settings['lat'], settings['lon'])
+
     try:
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        weather_cache["data"] = data
-        weather_cache["timestamp"] = now
-        weather_cache["lon"] = settings["lon"]
-        weather_cache["lat"] = settings["lat"]
-        return data
+        response = response_cache.cached_get(weather_cache_name(), url, timeout=5, deadline=deadline)
+        forecast = Forecast(json.loads(response.body), settings["forecast_hours"])
+        # Make sure every icon this forecast needs is on disk before it is rendered
+        warm_icons(forecast.codes, deadline=deadline)
+        return forecast
     except Exception as e:
         print("Weather fetch error:", e)
         return None
 
 
-def extract_forecast_data(data):
-    hours = data["hourly"]["time"]
-    temps = data["hourly"]["temperature_2m"]
-    precipitation_probs = data["hourly"]["precipitation_probability"]
-    codes_data = data["hourly"]["weathercode"]
-    uv_index = data["hourly"]["uv_index"]
-    is_day_array = data["hourly"]["is_day"]
-
-    now = datetime.now()
-    result = {}
+def latest_forecast():
+    snapshot = weather_fetcher.latest()
+    if not snapshot:
+        return None
 
-    for i, t in enumerate(hours):
-        dt = datetime.fromisoformat(t)
-        if dt.hour in settings["forecast_hours"] and dt.date() == now.date():
-            result[dt.hour] = {
-                "temp": temps[i],
-                "precipitation_probability": precipitation_probs[i],
-                "code": codes_data[i],
-                "uv_index": uv_index[i],
-                "is_day": bool(is_day_array[i])
-            }
-    return result
+    if snapshot.data.date != date.today():
+        weather_fetcher.refresh()  # Past midnight, so fetch today's forecast
+    return snapshot
 
 
 def showWeather():
     print("Showing weather forecast...")
-    global matrix, last_forecast_data, last_rendered_image
+    global matrix, last_forecast, last_icons, last_rendered_image
 
-    data = get_weather_forecast()
-    if not data:
+    snapshot = latest_forecast()
+    if not snapshot:
         return
 
-    time_data = extract_forecast_data(data)
-
-    if time_data == last_forecast_data:
+    # The forecast only changes when a new one is fetched, and its icons once they are downloaded
+    icons = icons_version
+    if snapshot.data is last_forecast and icons is last_icons:
         return last_rendered_image
 
-    last_forecast_data = time_data
+    last_forecast = snapshot.data
+    last_icons = icons
+    time_data = snapshot.data.forecast_hours
 
     image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
     draw = ImageDraw.Draw(image)
@@ -483,10 +600,10 @@ def showWeather():
         precip_x = x + (col_width - smallFont.getlength(precip_text)) // 2
         uv_x = x + (col_width - smallFont.getlength(uv_index_text)) // 2
 
-        draw.text((hour_x, y_start), hour_text, font=smallFont, fill=primaryColour)
-        draw.text((temp_x, y_start + 8), temp_text, font=smallFont, fill=tempColour)
-        draw.text((precip_x, y_start + 15), precip_text, font=smallFont, fill=rainColour)
-        draw.text((uv_x, y_start + 22), uv_index_text, font=smallFont, fill=uvColour)
+        draw_text(image, (hour_x, y_start), hour_text, smallFont, primaryColour)
+        draw_text(image, (temp_x, y_start + 8), temp_text, smallFont, tempColour)
+        draw_text(image, (precip_x, y_start + 15), precip_text, smallFont, rainColour)
+        draw_text(image, (uv_x, y_start + 22), uv_index_text, smallFont, uvColour)
 
         # Paste and centre the icon
         icon = get_icon(code, is_day, icon_size=(24, 24))
@@ -502,209 +619,173 @@ def showWeather():
     return image
 
 
-def showWeatherGraph():
-    global matrix
+weather_graph_cache = {
+    "key": None,
+    "background": None
+}
 
-    data = get_weather_forecast()
-    if not data:
-        return
+# Graph layout
+side_panel_width = 18
+graph_start_hour = 0
+graph_total_hours = 24
 
-    hours = data["hourly"]["time"]
-    temps = data["hourly"]["temperature_2m"]
-    precipitation_probs = data["hourly"]["precipitation_probability"]
-    uv_index = data["hourly"]["uv_index"]
 
-    now = datetime.now()
-    today = now.date()
-
-    # Filter data for today
-    times = []
-    today_temps = []
-    today_precip = []
-    today_uv = []
-    for i, t in enumerate(hours):
-        dt = datetime.fromisoformat(t)
-        if dt.date() == today:
-            times.append(dt)
-            today_temps.append(temps[i])
-            today_precip.append(precipitation_probs[i])
-            today_uv.append(uv_index[i])
-
-    if not times:
+def build_weather_graph(forecast, now):
+    if not len(forecast):
         return None
 
-    # Define sizes
-    side_panel_width = 18
     graph_width = matrix.width - side_panel_width
     height = matrix.height
 
-    # Create image
     image = Image.new("RGB", (matrix.width, height), (0, 0, 0))
     draw = ImageDraw.Draw(image)
 
     # Ranges
-    min_temp = min(today_temps)
-    max_temp = max(today_temps)
+    min_temp = forecast.min_temp
+    max_temp = forecast.max_temp
     temp_range = max_temp - min_temp or 1  # Avoid divide-by-zero
 
-    start_hour = 0
-    end_hour = 23
-    total_hours = end_hour - start_hour + 1
-
-    def scale_x(hour):
-        return int((hour - start_hour) / total_hours * graph_width)
-
-    def scale_y_temp(temp):
-        return int(height - ((temp - min_temp) / temp_range * height))
-
-    def scale_y_precip(prob):
-        return int(height - (prob / 100 * height))
-    
-    def scale_y_uv(uv):
-        return int(height - (uv / 11 * height))
-
-    # Draw temperature line
-    for i in range(1, len(times)):
-        x1 = scale_x(times[i - 1].hour)
-        y1 = scale_y_temp(today_temps[i - 1])
-        x2 = scale_x(times[i].hour)
-        y2 = scale_y_temp(today_temps[i])
-        draw.line((x1, y1, x2, y2), fill=tempColour, width=1)
-
-    # Draw precipitation line
-    for i in range(1, len(times)):
-        x1 = scale_x(times[i - 1].hour)
-        y1 = scale_y_precip(today_precip[i - 1])
-        x2 = scale_x(times[i].hour)
-        y2 = scale_y_precip(today_precip[i])
-        draw.line((x1, y1, x2, y2), fill=rainColour, width=1)
-
-    # Draw UV line
-    for i in range(1, len(times)):
-        x1 = scale_x(times[i - 1].hour)
-        y1 = scale_y_uv(today_uv[i - 1])
-        x2 = scale_x(times[i].hour)
-        y2 = scale_y_uv(today_uv[i])
-        draw.line((x1, y1, x2, y2), fill=uvColour, width=1)
-
-
-    # Draw current time marker
-    current_x = scale_x(now.hour + now.minute / 60)
-    draw.line((current_x, 0, current_x, height), fill=primaryColour, width=1)
+    # Scale every series in one pass and draw each as a single polyline
+    xs = ((forecast.hours - graph_start_hour) / graph_total_hours * graph_width).astype(int)
+    series = [
+        (height - (forecast.temps - min_temp) / temp_range * height, tempColour),
+        (height - forecast.precipitation / 100 * height, rainColour),
+        (height - forecast.uv_index / 11 * height, uvColour),
+    ]
+    if len(xs) > 1:
+        for ys, colour in series:
+            draw.line(list(zip(xs.tolist(), ys.astype(int).tolist())), fill=colour, width=1)
 
     # --- SIDE PANEL ---
     panel_x = matrix.width - side_panel_width
 
-    # Current temperature and precipitation
-    current_temp = None
-    current_precip = None
-    for i, dt in enumerate(times):
-        if dt.hour == now.hour:
-            current_temp = round(today_temps[i])
-            current_precip = round(today_precip[i])
-            current_uv = round(today_uv[i], 1)
-            break
-    if current_temp is None:
-        current_temp = round(today_temps[-1])
-    if current_precip is None:
-        current_precip = round(today_precip[-1])
-    if current_uv is None:
-        current_uv = round(today_uv[-1], 1)
+    # Current temperature and precipitation, falling back to the last hour of the day
+    current = forecast.current(now.hour)
+    current_temp = round(current["temp"])
+    current_precip = round(current["precipitation_probability"])
+    current_uv = round(current["uv_index"], 1)
 
     draw.line((panel_x-1, 0, panel_x-1, height), fill=secondaryColour, width=1)
 
     # Draw temperatures
-    draw.text((panel_x + 1, 0), datetime.now().strftime("%H:%M"), font=smallFont, fill=primaryColour)
-    draw.text((panel_x + 1, 7), f"{round(current_temp)}°", font=smallFont, fill=tempColour)
-    draw.text((panel_x + 1, 14), f"↑{round(max_temp)}°", font=smallFont, fill=(255, 0, 0))
-    draw.text((panel_x + 1, 21), f"↓{round(min_temp)}°", font=smallFont, fill=(0, 0, 255))
-    draw.text((panel_x + 1, 28), f"{round(current_precip)}%", font=smallFont, fill=rainColour)
-    draw.text((panel_x + 1, 35), f"ƀ{current_uv}", font=smallFont, fill=uvColour) # ƀ is the uv symbol is the custom font
+    draw_text(image, (panel_x + 1, 7), f"{round(current_temp)}°", smallFont, tempColour)
+    draw_text(image, (panel_x + 1, 14), f"↑{round(max_temp)}°", smallFont, (255, 0, 0))
+    draw_text(image, (panel_x + 1, 21), f"↓{round(min_temp)}°", smallFont, (0, 0, 255))
+    draw_text(image, (panel_x + 1, 28), f"{round(current_precip)}%", smallFont, rainColour)
+    draw_text(image, (panel_x + 1, 35), f"ƀ{current_uv}", smallFont, uvColour) # ƀ is the uv symbol is the custom font
 
     return image
 
-film_cache = {
-    "date": None,
-    "data": None
-}
 
-def showFilms(scroll_offset=0, page=0):
-    global film_cache, matrix
+def showWeatherGraph():
+    global matrix
 
-    today = datetime.now().date()
+    snapshot = latest_forecast()
+    if not snapshot:
+        return
 
-    if film_cache["date"] != today:
-        film_data = get_jamjar_films()
-        film_cache["data"] = film_data
-        film_cache["date"] = today
-    else:
-        film_data = film_cache["data"]
+    now = datetime.now()
 
-    image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
+    # Everything except the time marker and clock only changes with the data or the hour
+    key = (snapshot.data, now.date(), now.hour)
+    if weather_graph_cache["key"] != key:
+        weather_graph_cache["background"] = build_weather_graph(snapshot.data, now)
+        weather_graph_cache["key"] = key
+
+    background = weather_graph_cache["background"]
+    if background is None:
+        return None
+
+    image = background.copy()
     draw = ImageDraw.Draw(image)
 
+    # Draw current time marker, which the side-panel divider is drawn over
+    graph_width = matrix.width - side_panel_width
+    current_x = int((now.hour + now.minute / 60 - graph_start_hour) / graph_total_hours * graph_width)
+    if current_x < graph_width - 1:
+        draw.line((current_x, 0, current_x, matrix.height), fill=primaryColour, width=1)
+
+    draw_text(image, (graph_width + 1, 0), now.strftime("%H:%M"), smallFont, primaryColour)
+
+    return image
+
+films_page_cache = {
+    "refreshed_on": None,  # The day a refresh was last asked for at midnight
+    "key": None,
+    "films_key": None,
+    "films": [],
+    "background": None,
+    "marquees": []
+}
+
+def build_films_page(visible_films):
+    # Draw the lines that fit once, and pre-render a strip for each line that has to scroll
+    background = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
+    marquees = []
+
+    y = 0
+    for film in visible_films:
+        times = ", ".join(showtime.time for showtime in film.showtimes)
+        if len(listings.providers) > 1:
+            times = f"{film.cinema}: {times}"
+        for text, colour in ((film.title, primaryColour), (times, secondaryColour)):
+            if smallFont.getlength(text) <= matrix.width:
+                draw_text(background, (0, y), text, smallFont, colour)
+            else:
+                marquees.append((Marquee(text, smallFont, colour, matrix.width), y))
+            y += 6
+
+    films_page_cache["background"] = background
+    films_page_cache["marquees"] = marquees
+
+
+def showFilms(scroll_offset=0, page=0):
+    global matrix
+
+    snapshot = films_fetcher.latest()
+    if snapshot and date.fromtimestamp(snapshot.timestamp) != date.today():
+        # Past midnight, so fetch today's listings. Once a day: if that fails the fetcher retries by itself
+        if films_page_cache["refreshed_on"] != date.today():
+            films_page_cache["refreshed_on"] = date.today()
+            films_fetcher.refresh()
+        snapshot = None
+
+    # Showtimes drop off as they start, so the list is only rebuilt when the minute changes
+    now = datetime.now().strftime("%H:%M")
+    films_key = (snapshot.timestamp, now) if snapshot else None
+    if films_page_cache["films_key"] != films_key:
+        films_page_cache["films"] = upcoming_films(snapshot.data, now) if snapshot else []
+        films_page_cache["films_key"] = films_key
+    film_data = films_page_cache["films"]
+
     if not film_data:
+        image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
         # Draw "No films found" message centred
         text = "No films found"
         text_width = int(smallFont.getlength(text))
         x = max((matrix.width - text_width) // 2, 0)
         y = max((matrix.height - 6) // 2, 0)
-        draw.text((x, y), text, font=smallFont, fill=primaryColour)
+        draw_text(image, (x, y), text, smallFont, primaryColour)
         return image
 
-    pause_frames = 40  # ~2s at 20fps
     films_per_page = matrix.height // 6 // 2  # 2 lines per film, 6px per line
 
-    films = list(film_data.items())
-    total_pages = (len(films) + films_per_page - 1) // films_per_page
+    total_pages = (len(film_data) + films_per_page - 1) // films_per_page
     page = page % total_pages
 
-    start = page * films_per_page
-    end = start + films_per_page
-    visible_films = films[start:end]
-
-    y = 0
-    for title, times in visible_films:
-        # Handle title scrolling
-        title_width = int(smallFont.getlength(title))
-        if title_width <= matrix.width:
-            draw.text((0, y), title, font=smallFont, fill=primaryColour)
-        else:
-            max_scroll = title_width - matrix.width
-            total_cycle = pause_frames + max_scroll + pause_frames
-            scroll_pos = scroll_offset % total_cycle
-
-            if scroll_pos < pause_frames:
-                draw.text((0, y), title, font=smallFont, fill=primaryColour)
-            elif scroll_pos < pause_frames + max_scroll:
-                offset = scroll_pos - pause_frames
-                draw.text((-offset, y), title, font=smallFont, fill=primaryColour)
-            else:
-                draw.text((-max_scroll, y), title, font=smallFont, fill=primaryColour)
-
-        y += 6
-
-        # Handle times scrolling
-        times_str = ", ".join(times)
-        times_width = int(smallFont.getlength(times_str))
-        if times_width <= matrix.width:
-            draw.text((0, y), times_str, font=smallFont, fill=secondaryColour)
-        else:
-            max_scroll = times_width - matrix.width
-            total_cycle = pause_frames + max_scroll + pause_frames
-            scroll_pos = scroll_offset % total_cycle
-
-            if scroll_pos < pause_frames:
-                draw.text((0, y), times_str, font=smallFont, fill=secondaryColour)
-            elif scroll_pos < pause_frames + max_scroll:
-                offset = scroll_pos - pause_frames
-                draw.text((-offset, y), times_str, font=smallFont, fill=secondaryColour)
-            else:
-                draw.text((-max_scroll, y), times_str, font=smallFont, fill=secondaryColour)
+    # Strips only need rebuilding when the film list or the page changes
+    key = (films_key, page)
+    if films_page_cache["key"] != key:
+        start = page * films_per_page
+        end = start + films_per_page
+        build_films_page(film_data[start:end])
+        films_page_cache["key"] = key
 
-        y += 6
+    image = films_page_cache["background"].copy()
+    for marquee, y in films_page_cache["marquees"]:
+        marquee.draw(image, (0, y), scroll_offset)
 
-    draw.text((matrix.width - 4 * 3, matrix.height - 5), f"{page + 1}/{total_pages}", font=smallFont, fill=rainColour)
+    draw_text(image, (matrix.width - 4 * 3, matrix.height - 5), f"{page + 1}/{total_pages}", smallFont, rainColour)
 
     return image
 
@@ -733,85 +814,72 @@ def showLink():
     # Center the QR code on the background
     background.paste(qr_img, (0,7))
 
-    draw = ImageDraw.Draw(background)
-
-    draw.text((0, 0), "To change board settings:", font=smallFont, fill=secondaryColour)
+    draw_text(background, (0, 0), "To change board settings:", smallFont, secondaryColour)
 
-    draw.text((34, 6), "Scan QR or visit:", font=smallFont, fill=secondaryColour)
+    draw_text(background, (34, 6), "Scan QR or visit:", smallFont, secondaryColour)
 
     url = url.replace("https://", "")
 
     chunks = [url[i:i+15] for i in range(0, len(url), 15)]
     y = 12
     for chunk in chunks:
-        draw.text((34, y), chunk, font=smallFont, fill=primaryColour)
+        draw_text(background, (34, y), chunk, smallFont, primaryColour)
         y += 6
 
     return background
 
 
-cached_messages = []
-gotMessages = False
-last_msg_fetch_time = 0
+# Messages are pushed over MQTT (see on_message); HTTP is only used to load them when MQTT
+# hasn't yet, and to resync after a missed update
+def messages_changed():
+    # A pre-rendered messages frame is redrawn by the render loop when it next runs
+    if MODES[current_mode] == "messages":
+        update_event.set()
 
-def showMessages(page=0, lines_per_page=8):
-    global cached_messages, gotMessages, last_msg_fetch_time, force_refresh_messages
+message_store = MessageStore(on_change=messages_changed)
 
-    now = time.time()
-    if now - last_msg_fetch_time > 120 or not gotMessages or force_refresh_messages:
-        print("Fetching messages from server...")
-        try:
-            response = requests.get(f"https://dash.rubenp.com/get_messages/{BOARD_ID}")
-            messages_data = json.loads(response.text)['messages']
-            cached_messages = messages_data
-            last_msg_fetch_time = now
-            force_refresh_messages = False
-            gotMessages = True
-        except Exception as e:
-            print("Error fetching messages:", e)
-            messages_data = cached_messages
-    else:
-        print("Using cached messages...")
-        messages_data = cached_messages
 
-    image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
-    draw = ImageDraw.Draw(image)
+def messages_url(board_id):
+    return f"https://dash.rubenp.com/get_messages/{board_id}"
 
-    normal_width = 24
-    last_line_width = 21  # reserve 3 characters for "1/2", etc.
 
-    # Step 1: Wrap messages into lines considering word boundaries
-    all_lines = []
-    for message in messages_data:
-        text = message['text']
-        colour = message['colour']
-        max_line_length = last_line_width if (len(all_lines) + 1) % lines_per_page == 0 else normal_width
-        wrapped_lines = textwrap.wrap(text, width=max_line_length)
-        for line in wrapped_lines:
-            all_lines.append((line, colour))
+def get_messages(deadline=None):
+    if message_store.seq is not None and not message_store.needs_resync:
+        return message_store.messages()  # Already in sync from MQTT
 
-    total_pages = max(1, (len(all_lines) + lines_per_page - 1) // lines_per_page)
-    page = min(page, total_pages - 1)
+    print("Fetching messages from server...")
+    try:
+        response = response_cache.cached_get("messages", messages_url(BOARD_ID), timeout=10, deadline=deadline)
+        payload = json.loads(response.body)
+        message_store.apply_snapshot(payload['messages'], payload.get('seq'))
+        return message_store.messages()
+    except Exception as e:
+        print("Error fetching messages:", e)
+        return None
 
-    start = page * lines_per_page
-    end = start + lines_per_page
-    visible_lines = all_lines[start:end]
 
-    # Step 2: Draw lines
-    y = 0
-    for i, (line, colour) in enumerate(visible_lines):
-        draw.text((0, y), line, font=smallFont, fill=colour)
-        y += 6
+message_pages = None
+
+def showMessages(page=0, lines_per_page=8):
+    global message_pages
+
+    messages_data = message_store.messages()
 
-    # Step 3: Draw page number in bottom-right corner
-    page_text = f"{page + 1}/{total_pages}"
-    bbox = draw.textbbox((0, 0), page_text, font=smallFont)
-    text_width = bbox[2] - bbox[0]
+    if message_pages is None or message_pages.lines_per_page != lines_per_page:
+        message_pages = MessagePages(smallFont, (matrix.width, matrix.height), 6, lines_per_page, rainColour)
 
-    draw.text((matrix.width - text_width, matrix.height - 6), page_text, font=smallFont, fill=rainColour)
+    # Wrapped lines and page images are cached until the messages change
+    image, page, total_pages = message_pages.page(messages_data, page)
 
     return image, page + 1 < total_pages
 
+clock_cache = {
+    "date_text": None,
+    "background": None,
+    "image": None,
+    "time_text": ""
+}
+
 def showClock():
     now = datetime.now()
 
@@ -822,146 +890,579 @@ def showClock():
     time_text = f"{hours}:{minutes}:{seconds}"
     date_text = now.strftime("%a %d %b")
 
-    image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
-    draw = ImageDraw.Draw(image)
-
     # Centre time
     time_width = largeFont.getlength(time_text)
     time_x = (matrix.width - time_width) // 2
     time_y = (matrix.height // 2) - 10
 
-    draw.text(
-        (time_x, time_y),
-        time_text,
-        font=largeFont,
-        fill=primaryColour
-    )
+    # The date layer only needs composing once a day
+    if clock_cache["date_text"] != date_text:
+        background = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
+
+        # Centre date underneath
+        date_width = smallFont.getlength(date_text)
+        date_x = (matrix.width - date_width) // 2
+        draw_text(background, (date_x, time_y + 18), date_text, smallFont, (3, 9, 182))
+
+        clock_cache["date_text"] = date_text
+        clock_cache["background"] = background
+        clock_cache["image"] = background.copy()
+        clock_cache["time_text"] = ""
+
+    image = clock_cache["image"]
+    previous_text = clock_cache["time_text"]
+
+    # Only redraw the character cells that changed since the last tick
+    x = time_x
+    for i, char in enumerate(time_text):
+        char_width = largeFont.getlength(char)
+        if i >= len(previous_text) or previous_text[i] != char:
+            cell = (int(x), time_y, int(x + char_width), time_y + largeFont.height)
+            image.paste(clock_cache["background"].crop(cell), cell)
+            draw_text(image, (x, time_y), char, largeFont, primaryColour)
+        x += char_width
+
+    clock_cache["time_text"] = time_text
+    return image
 
-    # Centre date underneath
-    date_width = smallFont.getlength(date_text)
-    date_x = (matrix.width - date_width) // 2
-    draw.text(
-        (date_x, time_y + 18),
-        date_text,
-        font=smallFont,
-        fill=(3, 9, 182)
-    )
 
+# BACKGROUND DATA FETCHERS:
+# Each data source is polled on its own thread while its mode is on screen. The show*
+# functions above only read the latest snapshot, so a frame never waits on the network.
+departure_tracker = DepartureTracker()
+
+def get_departures(deadline=None):
+    times = get_platform_times([
+        (settings['station1'], settings['platform1']),
+        (settings['station2'], settings['platform2']),
+    ], until=deadline)
+    if all(t.error for t in times):
+        return None  # Keep showing the last good departures
+    return departure_tracker.update(times)
+
+
+# Loaders for the responses stored by the last boot, shown until each fetcher's first refresh
+def cached_weather():
+    cached = response_cache.load(weather_cache_name())
+    return cached and Snapshot(Forecast(json.loads(cached.body), settings["forecast_hours"]), cached.fetched_at)
+
+
+def cached_messages():
+    cached = response_cache.load("messages")
+    if not cached or message_store.messages():
+        return None  # Nothing stored, or MQTT has already delivered newer messages
+
+    payload = json.loads(cached.body)
+    message_store.apply_snapshot(payload['messages'], payload.get('seq'))
+    message_store.needs_resync = True  # Still fetched at boot, unless MQTT catches it up first
+    return Snapshot(message_store.messages(), cached.fetched_at)
+
+
+# Cinemas shown in films mode, fetched in parallel
+listings = Listings([JamJarProvider()])
+
+
+def mode_is(*modes):
+    # The next mode's data is kept fresh too when it is pre-rendered, at the cost of
+    # polling its upstream as often as the mode on screen's
+    return lambda: MODES[current_mode] in modes or (PRERENDER and next_mode() in modes)
+
+
+def wake_if_showing(*modes):
+    # Fetchers kept fresh for the next mode mustn't wake the render loop, which would
+    # move the mode on screen along early
+    def on_update():
+        if MODES[current_mode] in modes:
+            update_event.set()
+    return on_update
+
+
+def reachable(upstream):
+    return lambda: network.reachable(upstream)
+
+
+metro_fetcher = Fetcher("metro", get_departures, lambda: departure_tracker.poll_interval, active=mode_is("metro"), on_update=wake_if_showing("metro"), available=reachable("nexus"))
+weather_fetcher = Fetcher("weather", get_weather_forecast, 600, active=mode_is("weather", "weather_graph"), on_update=wake_if_showing("weather", "weather_graph"), load_cached=cached_weather, available=reachable("open_meteo"))
+# Only fetched at boot and to resync, whatever is on screen, so a missed update is caught straight away
+messages_fetcher = Fetcher("messages", get_messages, None, load_cached=cached_messages, available=reachable("dash"))
+films_fetcher = Fetcher("films", listings.fetch, 3600, active=mode_is("films"), on_update=wake_if_showing("films"), load_cached=listings.load_cached, available=reachable("jamjar"))
+
+fetchers = [metro_fetcher, weather_fetcher, messages_fetcher, films_fetcher]
+
+# The fetcher each mode draws from
+mode_fetchers = {
+    "metro": metro_fetcher,
+    "weather": weather_fetcher,
+    "weather_graph": weather_fetcher,
+    "films": films_fetcher,
+}
+
+# The upstream each fetcher needs, so it can catch up as soon as that comes back
+fetcher_upstreams = {
+    "nexus": metro_fetcher,
+    "open_meteo": weather_fetcher,
+    "dash": messages_fetcher,
+    "jamjar": films_fetcher,
+}
+
+
+def network_changed(target, up):
+    if not up:
+        return
+    # Anything fetched while the upstream was down was skipped, so its data is stale
+    if target == "link":
+        for upstream, fetcher in fetcher_upstreams.items():
+            if network.reachable(upstream):
+                fetcher.refresh()
+    elif target in fetcher_upstreams and network.online():
+        fetcher_upstreams[target].refresh()
+
+
+# Probes the link and each upstream in the background; fetchers skip requests to
+# anything it has seen go down and keep showing their last data
+network = NetworkMonitor(on_change=network_changed)
+# Any response from an upstream shows the link works, even if every probe is blocked
+http_client.on_response = network.response_received
+
+
+# Panel brightness per mode, if not 100
+MODE_BRIGHTNESS = {
+    "link": 75,
+    "clock": 80
+}
+
+
+class ModeState:
+    """
+    Where the scrolling and paged modes are up to.
+    """
+
+    def __init__(self):
+        self.scroll_offset = 0
+        self.page_counter = 0
+        self.page = 0
+
+    def reset(self, state=None):
+        # Start from the beginning, or from where `state` is up to
+        vars(self).update(vars(state or ModeState()))
+
+
+def render_frame(mode, state):
+    """
+    Renders the next frame of `mode`, moving `state` on. Returns None when there is
+    nothing to show yet, e.g. before the first fetch completes.
+    """
+    if mode == "metro":
+        return showMetro()
+
+    elif mode == "weather":
+        return showWeather()
+
+    elif mode == "weather_graph":
+        return showWeatherGraph()
+
+    elif mode == "films":
+        image = showFilms(state.scroll_offset, state.page)
+
+        state.scroll_offset += 1
+        state.page_counter += 1
+
+        if state.page_counter >= 400:
+            state.page_counter = 0
+            state.page += 1
+        return image
+
+    elif mode == "link":
+        return showLink()
+
+    elif mode == "messages":
+        image, has_more = showMessages(page=state.page)
+
+        state.page_counter += 1
+        if state.page_counter >= 1:
+            state.page_counter = 0
+            if has_more:
+                state.page += 1
+            else:
+                state.page = 0  # back to first page
+        return image
+
+    elif mode == "clock":
+        return showClock()
+
+    elif mode == "wifi_setup":
+        return showWifiSetup()
+
+    return None
+
+
+def publish_mode(mode):
+    if client is not None:  # MQTT may still be connecting during boot
+        client.publish(f"board/{BOARD_ID}/status", json.dumps({"mode": mode}))
+
+
+# PRE-RENDERING:
+# Between frames the render loop draws a frame of the next mode in MODES and keeps it
+# while it is current, so when the button is pressed that frame can go straight to the
+# panel and the mode carries on from it. A warm frame stays current until the data or
+# the time it shows changes, however long that is, as the loop only comes round to
+# redraw it on the mode on screen's cadence.
+WarmFrame = namedtuple("WarmFrame", ["mode", "image", "state", "inputs", "shown_time"])
+
+# The clock shows seconds, so it could never still be current; it is cheap to draw live
+NOT_PRERENDERED = ("clock", "link", "off")
+
+warm_frame = None
+
+
+def frame_inputs(mode):
+    # What a mode's frame is drawn from; snapshots and settings are replaced, never
+    # modified, so comparing them by identity says whether anything changed
+    if mode == "messages":
+        return (settings, message_store.messages())
+    fetcher = mode_fetchers.get(mode)
+    if mode == "weather":
+        return (settings, fetcher.latest(), icons_version)
+    return (settings, fetcher and fetcher.latest())
+
+
+def shown_time(mode):
+    # The part of a mode's frame drawn from the time rather than its data
+    if mode == "metro":
+        snapshot = metro_fetcher.latest()
+        if not snapshot:
+            return None
+        now = time.time()
+        return tuple(minutes_until(train, now) for times in snapshot.data for train in upcoming(times.trains, now)[:2])
+    if mode in ("weather_graph", "films"):
+        return datetime.now().strftime("%H:%M")
+    return None
+
+
+def is_warm(frame, mode):
+    if frame is None or frame.mode != mode:
+        return False
+    inputs = frame_inputs(mode)
+    return (all(a is b for a, b in zip(frame.inputs, inputs))
+            and frame.shown_time == shown_time(mode))
+
+
+def prerender_next():
+    global warm_frame
+    mode = next_mode()
+    if mode in NOT_PRERENDERED or is_warm(warm_frame, mode):
+        return
+
+    start = time.perf_counter()
+    state = ModeState()
+    inputs = frame_inputs(mode)
+    time_shown = shown_time(mode)
+    image = render_frame(mode, state)
+    if image is not None:
+        warm_frame = WarmFrame(mode, image, state, inputs, time_shown)
+    metrics.registry.histogram("prerender_seconds", "Time to pre-render the next mode, per mode", mode=mode).observe(time.perf_counter() - start)
+
+
+def take_warm_frame(mode):
+    # The pre-rendered frame for `mode` if it is still current, once only
+    global warm_frame
+    frame, warm_frame = warm_frame, None
+    return frame if is_warm(frame, mode) else None
+
+
+def draw_stale_marker(image):
+    # A dot in the top right corner to say the data on screen couldn't be refreshed
+    image = image.copy()  # Rendered frames may be cached
+    ImageDraw.Draw(image).rectangle((image.width - 2, 0, image.width - 1, 1), fill=staleColour)
     return image
 
+
+def mark_stale(mode, image):
+    fetcher = mode_fetchers.get(mode)
+    return draw_stale_marker(image) if fetcher and fetcher.stale() else image
+
+
+def board_pacer():
+    pacer = FramePacer(update_event)
+    metrics.registry.counter("missed_deadlines_total", "Frames skipped because rendering ran late", fn=lambda: pacer.missed_deadlines)
+    return pacer
+
+
+def board_frame(state, pacer, previous_mode):
+    """
+    Shows one frame of the current mode. Returns the mode shown.
+    """
+    pacer.start_frame()
+    metrics.registry.histogram("loop_lag_seconds", "How late each frame started").observe(pacer.lag)
+    frame_start = time.perf_counter()
+    switched = apply_mode_events()
+    mode = "wifi_setup" if wifi_setup_required.is_set() else MODES[current_mode]
+    matrix.brightness = MODE_BRIGHTNESS.get(mode, 100)
+
+    # Publish status if mode has changed
+    if mode != previous_mode:
+        publish_mode(mode)
+
+    if mode == "off":
+        presenter.clear()
+        led.off()
+        mode_switch_shown("clear")
+    else:
+        led.on()
+        warm = take_warm_frame(mode) if switched else None
+        if warm:
+            state.reset(warm.state)
+            image = warm.image
+        else:
+            if switched:
+                state.reset()
+            image = render_frame(mode, state)
+
+        if image is not None:  # Nothing to show until the first fetch completes
+            presenter.show(mark_stale(mode, image))
+            first_frame_shown()
+            mode_switch_shown("warm" if warm else "live")
+
+    metrics.registry.histogram("render_seconds", "Time to render and push a frame, per mode", mode=mode).observe(time.perf_counter() - frame_start)
+
+    if PRERENDER and mode == MODES[current_mode]:
+        prerender_next()
+    return mode
+
+
 def show_board():
-    global current_mode
-    global client
+    state = ModeState()
+    pacer = board_pacer()
+    mode = None
 
-    scroll_offset = 0
-    page_counter = 0
-    page = 0
-    previous_mode = None
+    while True:
+        mode = board_frame(state, pacer, mode)
+        pacer.wait(FRAME_INTERVALS[mode], align_to_second=(mode == "clock"))
+
+
+# RECEIVE MODE:
+# With FRAME_SOURCE=remote the board doesn't fetch or render anything itself. A render
+# server (render_server.py) sends it encoded frames for the mode it is in.
+frame_decoder = FrameDecoder()
+remote_frame = None  # The latest (image, brightness) from the render server
+
+# Ask again if no frame arrives for this long, in seconds, e.g. after the server restarts
+REMOTE_FRAME_TIMEOUT = KEYFRAME_INTERVAL * 2
+
+def request_frames():
+    # Tells the render server which mode to render and asks for a full frame to start from
+    if client is not None:
+        client.publish(f"boards/{BOARD_ID}/frame/request", json.dumps({"mode": MODES[current_mode]}))
+
+
+def receive_frame(payload):
+    global remote_frame
+    try:
+        remote_frame = frame_decoder.decode(payload)
+        update_event.set()
+    except MissingFrame as e:
+        print("Missed a frame, requesting a keyframe:", e)
+        request_frames()
+    except (ValueError, struct.error) as e:
+        print("Failed to decode frame:", e)
+
+
+def remote_frame_shown(previous_mode, shown):
+    """
+    Shows the latest frame from the render server if it is new. Returns the mode and
+    the frame now on screen.
+    """
+    apply_mode_events()
+    mode = MODES[current_mode]
+    if mode != previous_mode:
+        publish_mode(mode)
+        request_frames()
+
+    if wifi_setup_required.is_set():
+        presenter.show(showWifiSetup())
+    elif mode == "off":
+        presenter.clear()
+        led.off()
+        mode_switch_shown("clear")
+    elif remote_frame is not None and remote_frame is not shown:
+        led.on()
+        shown = remote_frame
+        image, brightness = shown
+        matrix.brightness = brightness
+        presenter.show(image)
+        first_frame_shown()
+        mode_switch_shown("remote")
+    return mode, shown
+
+
+def show_remote_frames():
+    mode = shown = None
 
     while True:
-        matrix.brightness = 100
-        mode = MODES[current_mode]
-
-        # Publish status if mode has changed
-        if mode != previous_mode:
-            msg = {
-                "mode": mode
-            }
-            client.publish(f"board/{BOARD_ID}/status", json.dumps(msg))
-            previous_mode = mode
-
-        if mode == "metro":
-            led.on()
-            image = showMetro()
-            matrix.SetImage(image.convert('RGB'))
-            wait_time = 30
-
-        elif mode == "weather":
-            led.on()
-            image = showWeather()
-            matrix.SetImage(image.convert('RGB'))
-            wait_time = 30
-
-        elif mode == "weather_graph":
-            led.on()
-            image = showWeatherGraph()
-            matrix.SetImage(image.convert('RGB'))
-            wait_time = 30
-
-        elif mode == "films":
-            led.on()
-            image = showFilms(scroll_offset, page)
-            matrix.SetImage(image.convert('RGB'))
-
-            scroll_offset += 1
-            page_counter += 1
-
-            if page_counter >= 400:
-                page_counter = 0
-                page += 1
-
-            wait_time = 0.08
-
-        elif mode == "link":
-            matrix.brightness = 75
-            led.on()
-            image = showLink()
-            matrix.SetImage(image)
-            update_event.wait()
-            update_event.clear()
-
-        elif mode == "messages":
-            matrix.brightness = 100
-            led.on()
-            image, has_more = showMessages(page=page)
-            matrix.SetImage(image)
-
-            page_counter += 1
-            if page_counter >= 1:
-                page_counter = 0
-                if has_more:
-                    page += 1
-                else:
-                    page = 0  # back to first page
-
-            wait_time = 15
-
-        elif mode == "clock":
-            matrix.brightness = 80
-            led.on()
-            image = showClock()
-            matrix.SetImage(image)
-            wait_time = 1
-
-        elif mode == "off":
-            matrix.Clear()
-            led.off()
-            update_event.wait()
-            update_event.clear()
-            continue
+        mode, shown = remote_frame_shown(mode, shown)
+        if not update_event.wait(REMOTE_FRAME_TIMEOUT) and mode != "off":
+            request_frames()
+        update_event.clear()
 
-        if update_event.wait(wait_time):
-            update_event.clear()
 
+# BOOT:
+# Everything that needs the network starts at once in the background, and the board
+# renders straight away from whatever it has: the clock needs nothing, and the other
+# modes show the data cached by the last boot until their fetchers catch up.
 
-if __name__ == '__main__':
-    if check_wifi():
-        print("Wi-Fi connected.")
+# Seconds from start to the first real frame that boot should stay within
+FIRST_FRAME_TARGET = 3
+
+wifi_setup_required = threading.Event()
+first_frame = threading.Event()
+
+def boot_stage(stage):
+    seconds = time.monotonic() - BOOT_STARTED
+    metrics.registry.gauge("boot_stage_seconds", "Seconds from start to each boot stage", stage=stage).set(round(seconds, 3))
+    print(f"Boot: {stage} after {seconds:.2f}s")
+    return seconds
 
-        # Fetch station names
-        stations = json.loads(requests.get("https://metro-rti.nexus.org.uk/api/stations").text)
+
+def first_frame_shown():
+    if first_frame.is_set():
+        return
+    first_frame.set()
+    if boot_stage("first_frame") > FIRST_FRAME_TARGET:
+        print(f"Time to first frame is over the {FIRST_FRAME_TARGET}s target")
+
+
+def showSplash():
+    image = Image.new("RGB", (matrix.width, matrix.height), (0, 0, 0))
+    text = "Starting..."
+    x = max((matrix.width - int(font.getlength(text))) // 2, 0)
+    y = max((matrix.height - font.height) // 2, 0)
+    draw_text(image, (x, y), text, font, primaryColour)
+    return image
+
+
+# Seconds without a link before the Wi-Fi setup access point is started: soon if the
+# board has not been online since boot (e.g. it is somewhere new), but only after a
+# long outage otherwise, as the access point takes the Wi-Fi off the network it was on
+SETUP_AFTER_BOOT = 20
+SETUP_AFTER_LOSS = 300
+
+# With the access point up the board can't see its old network come back, so every
+# AP_RETRY_INTERVAL seconds the access point is stopped for CLIENT_RETRY_TIME seconds
+# to let the Wi-Fi try to reconnect
+AP_RETRY_INTERVAL = 600
+CLIENT_RETRY_TIME = 60
+
+wifi_setup = {
+    "been_online": False,  # Whether the board has been online since boot
+    "ap_since": None,  # time.monotonic() the access point was started, or None if it isn't up
+    "retry_since": None,  # time.monotonic() the access point was stopped to retry the network
+}
+
+
+def watch_network():
+    network.start()
+    network.checked.wait()
+    boot_stage("network_checked")
+
+    while True:
+        update_wifi_setup()
+        time.sleep(PROBE_INTERVAL)
+
+
+def start_setup_access_point():
+    try:
+        create_access_point()
+    except OSError as e:
+        print("Failed to create access point:", e)
+    wifi_setup["ap_since"] = time.monotonic()
+    wifi_setup["retry_since"] = None
+
+
+def stop_setup_access_point():
+    try:
+        stop_access_point()
+    except OSError as e:
+        print("Failed to stop access point:", e)
+    wifi_setup["ap_since"] = None
+
+
+def update_wifi_setup():
+    """
+    Starts or stops the Wi-Fi setup access point from the network's state, stopping it
+    now and then to see if the old network is back.
+    """
+    now = time.monotonic()
+    if network.online():
+        wifi_setup["been_online"] = True
+        if wifi_setup["ap_since"] is not None or wifi_setup_required.is_set():
+            print("Network is back. Stopping Access Point.")
+            if wifi_setup["ap_since"] is not None:
+                stop_setup_access_point()
+            wifi_setup["retry_since"] = None
+            wifi_setup_required.clear()
+            update_event.set()
+        return
+
+    if wifi_setup["retry_since"] is not None:
+        if now - wifi_setup["retry_since"] >= CLIENT_RETRY_TIME:
+            print("Network still down. Restarting Access Point.")
+            start_setup_access_point()
+        return
+
+    if wifi_setup["ap_since"] is not None:
+        if now - wifi_setup["ap_since"] >= AP_RETRY_INTERVAL:
+            print("Stopping Access Point to retry the Wi-Fi network.")
+            stop_setup_access_point()
+            wifi_setup["retry_since"] = now
+        return
+
+    setup_after = SETUP_AFTER_LOSS if wifi_setup["been_online"] else SETUP_AFTER_BOOT
+    if network.down_for() >= setup_after:
+        print("No network detected. Creating Access Point.")
+        start_setup_access_point()
+        # The QR code stays up while the network is being retried
+        wifi_setup_required.set()
+        update_event.set()
+
+
+def load_stations():
+    global stations
+    # Use the station names from the last boot while they are fetched again
+    stations = cached_stations()
+    refresh_stations()
+    boot_stage("stations")
+
+
+if __name__ == '__main__':
+    presenter.show(showSplash())
+    boot_stage("splash")
+
+    if RUNTIME == "asyncio":
+        import sys
+        import asyncio
+        import async_runtime
+        # Hand over this module, as importing main again would set the board up twice
+        asyncio.run(async_runtime.run(sys.modules[__name__]))
+    else:
+        threading.Thread(target=watch_network, daemon=True).start()
 
         # Start MQTT thread
         threading.Thread(target=run_mqtt, daemon=True).start()
+        threading.Thread(target=publish_metrics, daemon=True).start()
 
-        # Wait for MQTT to connect
-        if mqtt_connected.wait(timeout=10):
-            print("MQTT connected.")
-            show_board()
+        # Serves /metrics for Prometheus, and the Wi-Fi setup form without a network
+        threading.Thread(target=run_flask, daemon=True).start()
+
+        if FRAME_SOURCE == "remote":
+            show_remote_frames()
         else:
-            print("MQTT connection timeout.")
+            threading.Thread(target=load_stations, daemon=True).start()
 
-    else:
-        print("No Wi-Fi detected. Creating Access Point.")
-        create_access_point()
-        display_qr_code()
+            # Download any weather icons that aren't cached yet
+            threading.Thread(target=warm_weather_icons, daemon=True).start()
+
+            # Start background data fetchers
+            for fetcher in fetchers:
+                fetcher.start()
+
+            show_board()
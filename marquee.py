@@ -0,0 +1,32 @@
+from PIL import Image
+
+
+class Marquee:
+    """
+    A line of text too wide for the panel. It is rendered once into a strip and each
+    frame pastes the window for the current scroll position, pausing at either end.
+    """
+
+    def __init__(self, text, font, colour, width, pause_frames=40):
+        self.width = width
+        self.pause_frames = pause_frames
+
+        text_width = int(font.getlength(text))
+        self.max_scroll = max(text_width - width, 0)
+
+        self.strip = Image.new("RGB", (max(text_width, width), font.height), (0, 0, 0))
+        font.draw(self.strip, (0, 0), text, colour)
+
+    def offset(self, scroll_offset):
+        total_cycle = self.pause_frames + self.max_scroll + self.pause_frames
+        scroll_pos = scroll_offset % total_cycle
+
+        if scroll_pos < self.pause_frames:
+            return 0
+        elif scroll_pos < self.pause_frames + self.max_scroll:
+            return scroll_pos - self.pause_frames
+        return self.max_scroll
+
+    def draw(self, image, xy, scroll_offset):
+        offset = self.offset(scroll_offset)
+        image.paste(self.strip.crop((offset, 0, offset + self.width, self.strip.height)), xy)
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from PIL import Image
+
+# How many message lists to keep laid out (the current one, plus one to flip back to)
+MAX_CACHED_LAYOUTS = 2
+
+
+def wrap_text(text, font, line_width, first_line=0):
+    """
+    Word-wraps `text` by rendered pixel width. `line_width(n)` gives the width available
+    for overall line n, starting from `first_line`. Words wider than a line are split.
+    """
+    lines = []
+    line = ""
+
+    def width():
+        return line_width(first_line + len(lines))
+
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if font.getlength(candidate) <= width():
+            line = candidate
+            continue
+
+        if line:
+            lines.append(line)
+            line = ""
+
+        # Break a word that can't fit on a line of its own
+        while font.getlength(word) > width():
+            cut = len(word)
+            while cut > 1 and font.getlength(word[:cut]) > width():
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        line = word
+
+    if line:
+        lines.append(line)
+    return lines
+
+
+class MessagePages:
+    """
+    Lays out a list of messages into pages of lines wrapped by real glyph width and
+    renders each page once. Both are cached by the contents of the message list, so
+    flipping pages costs nothing until the messages change.
+    """
+
+    def __init__(self, font, size, line_height, lines_per_page, label_colour):
+        self.font = font
+        self.size = size
+        self.line_height = line_height
+        self.lines_per_page = lines_per_page
+        self.label_colour = label_colour
+        self._layouts = OrderedDict()
+
+    def _layout(self, messages):
+        # The contents themselves, not their hash, so lists that collide can't share pages
+        key = tuple((m['text'], str(m['colour'])) for m in messages)
+        layout = self._layouts.get(key)
+        if layout is not None:
+            self._layouts.move_to_end(key)
+            return layout
+
+        width = self.size[0]
+        # The last line of each page shares its row with the page label, so leave room for it
+        label_width = self.font.getlength("9/9")
+        for _ in range(2):
+            def line_width(n):
+                is_last = (n + 1) % self.lines_per_page == 0
+                return width - label_width if is_last else width
+
+            lines = []
+            for message in messages:
+                for line in wrap_text(message['text'], self.font, line_width, len(lines)):
+                    lines.append((line, message['colour']))
+
+            total_pages = max(1, (len(lines) + self.lines_per_page - 1) // self.lines_per_page)
+            needed = self.font.getlength(f"{total_pages}/{total_pages}")
+            if needed <= label_width:
+                break
+            label_width = needed  # Ten or more pages, so lay out again with a wider label
+
+        layout = {"lines": lines, "total_pages": total_pages, "pages": {}}
+        self._layouts[key] = layout
+        if len(self._layouts) > MAX_CACHED_LAYOUTS:
+            self._layouts.popitem(last=False)
+        return layout
+
+    def page(self, messages, page):
+        """
+        Returns (image, page, total_pages) for `page` of `messages`, clamped to the last page.
+        """
+        layout = self._layout(messages)
+        total_pages = layout["total_pages"]
+        page = min(page, total_pages - 1)
+
+        image = layout["pages"].get(page)
+        if image is None:
+            image = Image.new("RGB", self.size, (0, 0, 0))
+
+            start = page * self.lines_per_page
+            y = 0
+            for line, colour in layout["lines"][start:start + self.lines_per_page]:
+                self.font.draw(image, (0, y), line, colour)
+                y += self.line_height
+
+            # Page number in the bottom-right corner
+            page_text = f"{page + 1}/{total_pages}"
+            text_width = self.font.getlength(page_text)
+            self.font.draw(image, (self.size[0] - text_width, self.size[1] - self.line_height), page_text, self.label_colour)
+
+            layout["pages"][page] = image
+
+        return image, page, total_pages
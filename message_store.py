@@ -0,0 +1,78 @@
+import threading
+
+
+class MessageStore:
+    """
+    The board's messages keyed by ID, kept in sync from MQTT: full snapshots arrive on
+    a retained topic and add/update/remove deltas in between, each with a sequence
+    number. A delta that doesn't follow on from the last sequence number, or that adds
+    or updates a message without an ID, is rejected so the caller can resync, and
+    `needs_resync` stays set until a snapshot is applied. Snapshots older than the
+    store, e.g. an HTTP fetch that finished after a newer delta, are ignored.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.seq = None
+        self.needs_resync = False
+        self._messages = {}
+        self._view = ()
+        self._lock = threading.Lock()
+
+    def _message_id(self, index, message):
+        return message.get("id", index)
+
+    def _publish(self):
+        # Callers read an immutable tuple, replaced on every change
+        self._view = tuple(self._messages.values())
+        if self.on_change:
+            self.on_change()
+
+    def messages(self):
+        return self._view
+
+    def apply_snapshot(self, messages, seq=None):
+        """
+        Replaces every message. Returns False if the snapshot was older than the store.
+        """
+        with self._lock:
+            if seq is not None and self.seq is not None and seq < self.seq:
+                return False
+            self._messages = {self._message_id(i, m): m for i, m in enumerate(messages)}
+            self.seq = seq
+            self.needs_resync = False
+            self._publish()
+            return True
+
+    def apply_delta(self, delta):
+        """
+        Applies an add/update/remove delta. Returns False if there is a sequence gap or
+        the delta can't be applied safely, in which case the caller should resync.
+        """
+        with self._lock:
+            seq = delta.get("seq")
+            # Without a known sequence (e.g. after an HTTP resync) deltas are still safe to
+            # apply, as adding, updating or removing by ID twice has no extra effect
+            if self.seq is not None and seq is not None:
+                if seq <= self.seq:
+                    return True  # Already applied
+                if seq != self.seq + 1:
+                    self.needs_resync = True
+                    return False
+
+            op = delta.get("op")
+            if op in ("add", "update"):
+                message = delta["message"]
+                if "id" not in message:
+                    self.needs_resync = True
+                    return False  # Any key made up here could clash with another message
+                self._messages[message["id"]] = message
+            elif op == "remove":
+                self._messages.pop(delta.get("id"), None)
+            else:
+                print("Unknown message delta:", op)
+
+            if seq is not None:
+                self.seq = seq
+            self._publish()
+            return True
@@ -0,0 +1,243 @@
+import os
+import time
+import bisect
+import threading
+from urllib.parse import urlparse
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Friendly names for the hosts the board talks to, used as the `upstream` label
+UPSTREAMS = {
+    "metro-rti.nexus.org.uk": "nexus",
+    "api.open-meteo.com": "open_meteo",
+    "dash.rubenp.com": "dash",
+    "www.jamjarcinema.com": "jamjar",
+}
+
+PREFIX = "board_"
+
+
+class Counter:
+    """
+    A value that only goes up. `fn` optionally reads the value from elsewhere instead,
+    for counts something else already keeps.
+    """
+
+    kind = "counter"
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self.fn() if self.fn else self._value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self._value = value
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, so recording one is cheap enough to do
+    every frame. Quantiles are estimated from the bucket bounds.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        # The upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+
+class Registry:
+    """
+    Holds every metric by name and labels. Metrics are created on first use, so
+    instrumented code just asks for the one it wants each time.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # (name, labels) -> metric
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, cls(**kwargs))
+                if help:
+                    self._help.setdefault(name, help)
+        return metric
+
+    def counter(self, name, help="", fn=None, **labels):
+        return self._get(Counter, name, help, labels, fn=fn)
+
+    def gauge(self, name, help="", fn=None, **labels):
+        return self._get(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def _series(self):
+        with self._lock:
+            return sorted(self._metrics.items(), key=lambda item: item[0])
+
+    def prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        previous = None
+        for (name, labels), metric in self._series():
+            full_name = PREFIX + name
+            if name != previous:
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} {metric.kind}")
+                previous = name
+
+            if metric.kind != "histogram":
+                lines.append(f"{full_name}{_labels(labels)} {_number(metric.value)}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(_bucket_bounds(metric), metric.counts):
+                cumulative += count
+                lines.append(f"{full_name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{full_name}_sum{_labels(labels)} {_number(metric.sum)}")
+            lines.append(f"{full_name}_count{_labels(labels)} {metric.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Returns a compact dict of every metric for publishing over MQTT. Labelled
+        metrics are nested by their label values, and histograms are summarised as
+        their count and estimated p50/p95.
+        """
+        result = {}
+        for (name, labels), metric in self._series():
+            if metric.kind == "histogram":
+                value = {"n": metric.count, "p50": metric.quantile(0.5), "p95": metric.quantile(0.95)}
+            else:
+                value = metric.value
+                value = round(value, 4) if isinstance(value, float) else value
+
+            if labels:
+                result.setdefault(name, {})[",".join(str(v) for _, v in labels)] = value
+            else:
+                result[name] = value
+        return result
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _bucket_bounds(histogram):
+    return [_number(bound) for bound in histogram.buckets] + ["+Inf"]
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+def record_request(url, seconds, error=None):
+    """
+    Records one HTTP request to an upstream: its latency, and whether it failed.
+    """
+    host = urlparse(url).hostname
+    upstream = UPSTREAMS.get(host, host)
+    registry.histogram("upstream_request_seconds", "HTTP request latency per upstream", upstream=upstream).observe(seconds)
+    outcome = "ok" if error is None else "error"
+    registry.counter("upstream_requests_total", "HTTP requests per upstream and outcome", upstream=upstream, outcome=outcome).inc()
+
+
+def cache_counters(cache):
+    """
+    Returns (hits, misses) counters for one of the board's caches and keeps a hit
+    ratio for it. Hot paths should look these up once and hold on to them.
+    """
+    hits = registry.counter("cache_hits_total", "Cache lookups served from the cache", cache=cache)
+    misses = registry.counter("cache_misses_total", "Cache lookups that missed", cache=cache)
+
+    def hit_ratio():
+        total = hits.value + misses.value
+        return hits.value / total if total else None
+
+    registry.gauge("cache_hit_ratio", "Share of cache lookups that hit", fn=hit_ratio, cache=cache)
+    return hits, misses
+
+
+def _resident_memory():
+    # Current RSS from /proc, on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _CpuPercent:
+    # CPU use since the last time it was read, as a percentage of one core
+    def __init__(self):
+        self.last = (time.monotonic(), time.process_time())
+        self.percent = 0.0
+
+    def __call__(self):
+        now = (time.monotonic(), time.process_time())
+        elapsed = now[0] - self.last[0]
+        if elapsed >= 1:
+            self.percent = 100 * (now[1] - self.last[1]) / elapsed
+            self.last = now
+        return self.percent
+
+
+_started = time.monotonic()
+
+registry.gauge("process_resident_memory_bytes", "Resident memory", fn=_resident_memory)
+registry.counter("process_cpu_seconds_total", "CPU time used", fn=time.process_time)
+registry.gauge("process_cpu_percent", "CPU use since the last read, % of one core", fn=_CpuPercent())
+registry.gauge("uptime_seconds", "Seconds since start", fn=lambda: time.monotonic() - _started)
+registry.gauge("process_threads", "Threads running", fn=threading.active_count)
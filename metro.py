@@ -0,0 +1,170 @@
+import time
+import json
+import math
+import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+import response_cache
+import http_client
+
+API_URL = "https://metro-rti.nexus.org.uk/api"
+
+# Per-request socket timeouts (connect covers the TLS handshake) and a hard limit
+# on a whole refresh, so a hung request can never stall the board.
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 5
+DEADLINE = 8
+
+# How many trains to keep per platform, so the board still has two to show as trains leave between polls
+TRAINS_PER_PLATFORM = 4
+
+# A train stays on the board this long after its expected time ("Due"). Trains a poll
+# lists as already due (dueIn 0 or less) stay until a poll stops listing them.
+DEPARTED_AFTER = 60
+
+# Poll interval bounds, in seconds
+MIN_POLL_INTERVAL = 15
+MAX_POLL_INTERVAL = 120
+IDLE_POLL_INTERVAL = 600
+
+# Departures for one station/platform pair. `latency` is in seconds, `error` is None on success.
+PlatformTimes = namedtuple("PlatformTimes", ["station", "platform", "trains", "latency", "error"])
+
+# A predicted departure. `expected` is a Unix time, so the board can count down between polls.
+Departure = namedtuple("Departure", ["destination", "expected", "train"])
+
+# One keep-alive session shared by every request to the Nexus API
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="metro")
+
+
+def _get_times(station, platform, deadline):
+    url = f"{API_URL}/times/{station}/{platform}"
+    start = time.monotonic()
+    try:
+        response = http_client.get(url, session=session, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), deadline=deadline)
+        trains = tuple(response.json()[:TRAINS_PER_PLATFORM])
+        return PlatformTimes(station, platform, trains, time.monotonic() - start, None)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return PlatformTimes(station, platform, (), time.monotonic() - start, str(e))
+
+
+def get_platform_times(pairs, deadline=DEADLINE, until=None):
+    """
+    Fetches departures for every (station, platform) pair at the same time.
+    Returns a PlatformTimes for each pair, in order, within `deadline` seconds, or
+    by the time.monotonic() `until` if that is sooner.
+    """
+    unique_pairs = list(dict.fromkeys(pairs))
+    # Requests are cut short at the deadline too, rather than holding a worker after it
+    if until is not None:
+        deadline = max(min(deadline, until - time.monotonic()), 0)
+    until = time.monotonic() + deadline
+    futures = {pair: _executor.submit(_get_times, *pair, until) for pair in unique_pairs}
+    done, _ = wait(futures.values(), timeout=deadline)
+
+    results = {}
+    for pair, future in futures.items():
+        if future in done:
+            results[pair] = future.result()
+        else:
+            future.cancel()
+            results[pair] = PlatformTimes(*pair, (), deadline, "deadline exceeded")
+
+        result = results[pair]
+        status = "ok" if result.error is None else result.error
+        print(f"Metro {result.station}/{result.platform}: {result.latency * 1000:.0f}ms ({status})")
+
+    return [results[pair] for pair in pairs]
+
+
+def is_due(departure):
+    return int(departure.train["dueIn"]) <= 0
+
+
+def upcoming(departures, now):
+    return [d for d in departures if d.expected > now - DEPARTED_AFTER or is_due(d)]
+
+
+def minutes_until(departure, now):
+    return math.ceil((departure.expected - now) / 60)
+
+
+class DepartureTracker:
+    """
+    Turns each poll's dueIn minutes into expected departure times and decides how long
+    to wait before polling again: often when a train is close or predictions are
+    moving, rarely when nothing is running.
+    """
+
+    def __init__(self):
+        self.departures = {}  # (station, platform) -> PlatformTimes of Departures
+        self.poll_interval = MIN_POLL_INTERVAL
+        self.idle_polls = 0
+
+    def _train_key(self, index, train):
+        return train.get("trn") or (train.get("destination"), index)
+
+    def update(self, platform_times, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        results = []
+        drift = 0
+
+        for times in platform_times:
+            pair = (times.station, times.platform)
+            previous = self.departures.get(pair)
+
+            if times.error and previous:
+                # Keep counting down the last good departures for this platform
+                results.append(previous)
+                continue
+
+            # dueIn is -1 for a train that is late leaving, which the board shows as Due too
+            departures = tuple(
+                Departure(train["destination"], fetched_at + max(int(train["dueIn"]), 0) * 60, train)
+                for train in times.trains
+            )
+
+            # How far the predictions for trains we already knew about have moved
+            if previous:
+                old = {self._train_key(i, d.train): d.expected for i, d in enumerate(previous.trains)}
+                for i, d in enumerate(departures):
+                    key = self._train_key(i, d.train)
+                    if key in old:
+                        drift = max(drift, abs(d.expected - old[key]))
+
+            result = times._replace(trains=departures)
+            self.departures[pair] = result
+            results.append(result)
+
+        self.poll_interval = self._next_interval(results, drift, fetched_at)
+        return tuple(results)
+
+    def _next_interval(self, results, drift, now):
+        expected = [d.expected for times in results for d in upcoming(times.trains, now)]
+        if not expected:
+            # No services: back off, doubling up to the idle interval
+            self.idle_polls += 1
+            return min(MIN_POLL_INTERVAL * 2 ** self.idle_polls, IDLE_POLL_INTERVAL)
+        self.idle_polls = 0
+
+        if drift > 60:
+            return MIN_POLL_INTERVAL  # Predictions are moving; keep a close eye on them
+
+        # Poll about twice before the next train is due
+        soonest = min(expected) - now
+        return min(max(soonest / 2, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+
+def get_stations():
+    response = response_cache.cached_get("stations", f"{API_URL}/stations", session=session, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    return json.loads(response.body)
+
+
+def cached_stations():
+    # The station list from the last boot, or {} if there has never been one
+    cached = response_cache.load("stations")
+    return json.loads(cached.body) if cached else {}
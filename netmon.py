@@ -0,0 +1,193 @@
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# The link is up if the interface with the default route is up and its gateway
+# answers, or if any probe or request gets through. TCP connects to public DNS
+# servers are one more way through, not the only one, as some networks block them.
+LINK_PROBES = [("8.8.8.8", 53), ("1.1.1.1", 53)]
+GATEWAY_PORT = 53  # Refused counts too: the gateway still answered
+
+ROUTES = "/proc/net/route"
+INTERFACES = "/sys/class/net"
+
+# Each upstream is probed with a TCP connect to its HTTPS port
+UPSTREAM_PROBES = {name: (host, 443) for host, name in metrics.UPSTREAMS.items()}
+
+PROBE_INTERVAL = 10  # Seconds between rounds of probes
+PROBE_TIMEOUT = 2
+
+# Hysteresis: how many probes in a row it takes to change a target's state, so one
+# dropped packet doesn't flip the board offline and back
+DOWN_AFTER = 2
+UP_AFTER = 2
+
+
+class TargetState:
+    """
+    Whether one probe target is up, only changing after several probes agree.
+    """
+
+    def __init__(self):
+        self.up = True  # Assume reachable until shown otherwise, so boot fetches go ahead
+        self.streak = 0  # Consecutive probes that disagreed with `up`
+        self.changed_at = time.monotonic()
+
+    def seen(self):
+        """
+        Marks the target up straight away, for when something got a response from it.
+        Returns True if the state changed.
+        """
+        self.streak = 0
+        if self.up:
+            return False
+        self.up = True
+        self.changed_at = time.monotonic()
+        return True
+
+    def record(self, ok):
+        """
+        Records one probe result. Returns True if the state changed.
+        """
+        if ok == self.up:
+            self.streak = 0
+            return False
+
+        self.streak += 1
+        if self.streak < (UP_AFTER if ok else DOWN_AFTER):
+            return False
+
+        self.up = ok
+        self.streak = 0
+        self.changed_at = time.monotonic()
+        return True
+
+
+def probe(address, timeout=PROBE_TIMEOUT, refused_ok=False):
+    try:
+        with socket.create_connection(address, timeout=timeout):
+            return True
+    except ConnectionRefusedError:
+        return refused_ok
+    except OSError:  # Includes DNS failures and timeouts
+        return False
+
+
+def default_route():
+    """
+    Returns (interface, gateway address) for the default route, or None if there isn't one.
+    """
+    try:
+        with open(ROUTES) as f:
+            next(f)  # Header
+            for line in f:
+                fields = line.split()
+                # Destination 0.0.0.0 with the gateway flag set
+                if len(fields) > 3 and fields[1] == "00000000" and int(fields[3], 16) & 0x2:
+                    return fields[0], socket.inet_ntoa(int(fields[2], 16).to_bytes(4, "little"))
+    except (OSError, ValueError, StopIteration):
+        pass
+    return None
+
+
+def interface_up(interface):
+    # For Wi-Fi "up" means associated with the network; some drivers only report "unknown"
+    try:
+        with open(f"{INTERFACES}/{interface}/operstate") as f:
+            return f.read().strip() in ("up", "unknown")
+    except OSError:
+        return False
+
+
+def probe_gateway():
+    """
+    Whether the interface with the default route is up and its gateway answers a connect.
+    """
+    route = default_route()
+    if route is None:
+        return False
+    interface, gateway = route
+    return interface_up(interface) and probe((gateway, GATEWAY_PORT), refused_ok=True)
+
+
+class NetworkMonitor:
+    """
+    Probes the link and every upstream on a background thread and keeps their state
+    with hysteresis. Fetchers ask reachable() before making a request, so an outage
+    costs one probe every PROBE_INTERVAL rather than a full timeout per fetch.
+
+    `on_change(target, up)` is called when a target changes state; the link's target
+    name is "link". response_received() is called when any request gets a response,
+    which brings the link and that upstream up without waiting for the next probes.
+    """
+
+    def __init__(self, upstreams=UPSTREAM_PROBES, on_change=None):
+        self.upstreams = upstreams
+        self.on_change = on_change
+        self.states = {"link": TargetState()}
+        self.states.update({name: TargetState() for name in upstreams})
+        self.checked = threading.Event()  # Set after the first round of probes
+        self._executor = ThreadPoolExecutor(max_workers=len(LINK_PROBES) + len(upstreams) + 1, thread_name_prefix="netmon")
+        self._thread = None
+        self._lock = threading.Lock()  # Requests report responses from their own threads
+
+        for name, state in self.states.items():
+            metrics.registry.gauge("network_up", "Whether the link and each upstream are reachable", fn=lambda state=state: int(state.up), target=name)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="netmon", daemon=True)
+            self._thread.start()
+
+    def online(self):
+        return self.states["link"].up
+
+    def reachable(self, upstream):
+        state = self.states.get(upstream)
+        return self.online() and (state is None or state.up)
+
+    def down_for(self, target="link"):
+        # Seconds the target has been down, or 0 if it is up
+        state = self.states[target]
+        return 0 if state.up else time.monotonic() - state.changed_at
+
+    def _record(self, target, ok):
+        with self._lock:
+            changed = self.states[target].record(ok)
+        self._changed(target, ok, changed)
+
+    def _changed(self, target, up, changed):
+        if changed:
+            print(f"Network: {target} is {'up' if up else 'down'}")
+            if self.on_change:
+                self.on_change(target, up)
+
+    def response_received(self, upstream):
+        for target in ("link", upstream):
+            if target in self.states:
+                with self._lock:
+                    changed = self.states[target].seen()
+                self._changed(target, True, changed)
+
+    def check(self):
+        # One round of probes, all at once
+        link = [self._executor.submit(probe_gateway)]
+        link += [self._executor.submit(probe, address) for address in LINK_PROBES]
+        upstreams = {name: self._executor.submit(probe, address) for name, address in self.upstreams.items()}
+
+        upstream_up = {name: future.result() for name, future in upstreams.items()}
+        # Reaching any upstream means the link works, whatever the other probes say
+        self._record("link", any(future.result() for future in link) or any(upstream_up.values()))
+        for name, ok in upstream_up.items():
+            self._record(name, ok)
+        self.checked.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print("Network check failed:", e)
+            time.sleep(PROBE_INTERVAL)
@@ -0,0 +1,106 @@
+import math
+import time
+import asyncio
+import threading
+
+# Wake just after a second boundary so strftime is guaranteed to see the new second
+SECOND_ALIGN_SLACK = 0.005
+
+
+class WakeEvent(threading.Event):
+    """
+    A threading.Event that can also be awaited from an asyncio loop, so the same event
+    can wake a loop in either runtime. set() may be called from any thread; once the
+    event has been awaited, clear() should only be called on the loop's thread.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._async_event = None
+        self._loop = None
+
+    def set(self):
+        super().set()
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._async_event.set)
+
+    def clear(self):
+        super().clear()
+        if self._async_event is not None:
+            self._async_event.clear()
+
+    async def wait_async(self, timeout=None):
+        """
+        Waits until the event is set, or for `timeout` seconds. Returns True if it was set.
+        """
+        if self._loop is None:
+            self._async_event = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+        if self.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._async_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.is_set()
+
+
+class FramePacer:
+    """
+    Schedules render-loop frames against the monotonic clock. Each deadline is the
+    previous one plus the frame interval, so render and fetch time come out of the
+    sleep instead of adding to it. Setting `wake_event` preempts the wait immediately.
+    """
+
+    def __init__(self, wake_event):
+        self.wake_event = wake_event
+        self.deadline = None  # When the current frame was due
+        self.missed_deadlines = 0
+        self.lag = 0.0  # How late the current frame started
+
+    def start_frame(self):
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+        self.lag = max(now - self.deadline, 0)
+
+    def wait(self, interval, align_to_second=False):
+        """
+        Sleeps until the next frame is due, or until `wake_event` is set. An interval
+        of None waits for the event only. Returns True if the wait was preempted.
+        """
+        return self._woken(self.wake_event.wait(self._timeout(interval, align_to_second)))
+
+    async def wait_async(self, interval, align_to_second=False):
+        # wait() for the asyncio runtime; `wake_event` must be a WakeEvent
+        return self._woken(await self.wake_event.wait_async(self._timeout(interval, align_to_second)))
+
+    def _timeout(self, interval, align_to_second):
+        now = time.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+
+        if interval is None:
+            deadline = None
+        elif align_to_second:
+            if now - self.deadline > interval:
+                self.missed_deadlines += int((now - self.deadline) // interval)
+            deadline = now + (1 - time.time() % 1) + SECOND_ALIGN_SLACK
+        else:
+            deadline = self.deadline + interval
+            if deadline < now:
+                # Skip the frames we were too slow for rather than rushing to catch up
+                missed = math.ceil((now - deadline) / interval)
+                self.missed_deadlines += missed
+                deadline += missed * interval
+
+        self.deadline = deadline
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def _woken(self, woken):
+        if woken:
+            self.wake_event.clear()
+            self.deadline = None  # Start a fresh schedule after a mode or settings change
+            return True
+        return False
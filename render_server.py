@@ -0,0 +1,310 @@
+"""
+Renders frames for a fleet of boards in one headless process and streams them over
+MQTT, so boards running with FRAME_SOURCE=remote only decode and display.
+
+Upstream data is fetched once per distinct source (metro platform, weather location,
+cinema listings) and shared by every board that shows it. Each board's settings and
+messages come from the same retained topics the boards themselves use, and a board
+tells the server which mode it is in by publishing on boards/{id}/frame/request.
+
+The MQTT user needs to be able to subscribe to boards/+/... for every board.
+
+    python render_server.py
+"""
+import os
+import json
+import time
+import threading
+
+# The server has no panel or GPIO
+os.environ["DISPLAY_BACKEND"] = "null"
+os.environ.setdefault("BOARD_ID", "render-server")
+
+import ssl
+import paho.mqtt.client as mqtt
+import main
+import response_cache
+import metrics
+from fetchers import Fetcher, Snapshot
+from forecast import Forecast
+from frame_codec import FrameEncoder
+from message_store import MessageStore
+from metro import get_platform_times, get_stations, cached_stations, DepartureTracker
+from icon_cache import warm_icons
+
+# How often to re-render a mode that normally only redraws when woken, in seconds
+IDLE_FRAME_INTERVAL = 10
+
+
+class RemoteBoard:
+    """
+    What the server knows about one board: its settings, messages, the mode it is
+    in, and the state of its frame stream.
+    """
+
+    def __init__(self, board_id):
+        self.board_id = board_id
+        self.settings = dict(main.default_settings)
+        self.messages = MessageStore()
+        self.mode = None  # Not rendered until the board asks for frames
+        self.state = main.ModeState()
+        self.encoder = FrameEncoder()
+        self.next_frame = 0
+
+    def pairs(self):
+        return [
+            (self.settings["station1"], self.settings["platform1"]),
+            (self.settings["station2"], self.settings["platform2"]),
+        ]
+
+    def location(self):
+        return (self.settings["lat"], self.settings["lon"])
+
+
+class SharedData:
+    """
+    One Fetcher per upstream source, created when a board first needs it and only
+    polled while some board is showing it.
+    """
+
+    def __init__(self, boards, on_update):
+        self.boards = boards
+        self.on_update = on_update
+        self.metro = {}  # (station, platform) -> Fetcher
+        self.weather = {}  # (lat, lon) -> Fetcher of the raw forecast
+        self.forecasts = {}  # (lat, lon, forecast hours, download time) -> Snapshot of a Forecast
+        self.films = Fetcher("films", main.listings.fetch, 3600, active=self._showing("films"),
+                             on_update=on_update, load_cached=main.listings.load_cached)
+        self.films.start()
+        self._lock = threading.Lock()
+
+    def _showing(self, *modes, uses=None):
+        def active():
+            return any(b.mode in modes and (uses is None or uses(b)) for b in list(self.boards.values()))
+        return active
+
+    def _metro_fetcher(self, pair):
+        with self._lock:
+            fetcher = self.metro.get(pair)
+            if fetcher is None:
+                tracker = DepartureTracker()
+
+                def fetch(deadline):
+                    times = get_platform_times([pair], until=deadline)
+                    return None if times[0].error else tracker.update(times)[0]
+
+                fetcher = Fetcher(f"metro-{pair[0]}-{pair[1]}", fetch, lambda: tracker.poll_interval,
+                                  active=self._showing("metro", uses=lambda b: pair in b.pairs()), on_update=self.on_update)
+                fetcher.start()
+                self.metro[pair] = fetcher
+            return fetcher
+
+    def _weather_fetcher(self, location):
+        with self._lock:
+            fetcher = self.weather.get(location)
+            if fetcher is None:
+                lat, lon = location
+
+                def fetch(deadline):
+                    response = response_cache.cached_get(main.weather_cache_name(lat, lon), main.weather_url(lat, lon), timeout=5, deadline=deadline)
+                    return json.loads(response.body)
+
+                def load_cached():
+                    cached = response_cache.load(main.weather_cache_name(lat, lon))
+                    return cached and Snapshot(json.loads(cached.body), cached.fetched_at)
+
+                fetcher = Fetcher(f"weather-{lat}-{lon}", fetch, 600,
+                                  active=self._showing("weather", "weather_graph", uses=lambda b: b.location() == location),
+                                  on_update=self.on_update, load_cached=load_cached)
+                fetcher.start()
+                self.weather[location] = fetcher
+            return fetcher
+
+    def stale(self, board):
+        # Whether any source the board's mode is drawn from is serving data it couldn't refresh
+        if board.mode == "metro":
+            sources = [self._metro_fetcher(pair) for pair in board.pairs()]
+        elif board.mode in ("weather", "weather_graph"):
+            sources = [self._weather_fetcher(board.location())]
+        elif board.mode == "films":
+            sources = [self.films]
+        else:
+            sources = []
+        return any(fetcher.stale() for fetcher in sources)
+
+    def departures(self, board):
+        snapshots = [self._metro_fetcher(pair).latest() for pair in board.pairs()]
+        if None in snapshots:
+            return None
+        return Snapshot(tuple(s.data for s in snapshots), max(s.timestamp for s in snapshots))
+
+    def forecast(self, board):
+        raw = self._weather_fetcher(board.location()).latest()
+        if raw is None:
+            return None
+
+        # Boards at the same place share the download but may show different hours
+        key = board.location() + (tuple(board.settings["forecast_hours"]), raw.timestamp)
+        snapshot = self.forecasts.get(key)
+        if snapshot is None:
+            forecast = Forecast(raw.data, board.settings["forecast_hours"])
+            warm_icons(forecast.codes)
+            snapshot = Snapshot(forecast, raw.timestamp)
+            # Forecasts built from an older download are never shown again
+            self.forecasts = {k: v for k, v in self.forecasts.items() if k[3] == raw.timestamp or k[:2] != key[:2]}
+            self.forecasts[key] = snapshot
+        return snapshot
+
+
+class RenderServer:
+    def __init__(self):
+        self.boards = {}  # board ID -> RemoteBoard
+        self.wake = threading.Event()
+        self.data = SharedData(self.boards, self.data_updated)
+        self.client = None
+
+    def data_updated(self):
+        # Redraw every board straight away; frames that come out the same aren't sent
+        for board in list(self.boards.values()):
+            board.next_frame = 0
+        self.wake.set()
+
+    def board(self, board_id):
+        board = self.boards.get(board_id)
+        if board is None:
+            board = self.boards[board_id] = RemoteBoard(board_id)
+        return board
+
+    # MQTT
+
+    def on_connect(self, client, userdata, flags, rc):
+        print("Render server connected to MQTT broker with result code", rc)
+        client.subscribe("boards/+/settings")
+        client.subscribe("boards/+/messages/#")
+        client.subscribe("boards/+/message")
+        client.subscribe("boards/+/frame/request")
+
+    def on_message(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        board = self.board(parts[1])
+        topic = "/".join(parts[2:])
+
+        try:
+            if topic == "settings":
+                payload = json.loads(msg.payload.decode())
+                settings = {key: payload.get(key, value) for key, value in board.settings.items()}
+                settings["lat"], settings["lon"] = float(settings["lat"]), float(settings["lon"])
+                settings["forecast_hours"] = [int(h) for h in settings["forecast_hours"]]
+                board.settings = settings
+                board.next_frame = 0
+
+            elif topic == "messages/snapshot":
+                payload = json.loads(msg.payload.decode())
+                board.messages.apply_snapshot(payload["messages"], payload.get("seq"))
+
+            elif topic == "messages/delta":
+                if not board.messages.apply_delta(json.loads(msg.payload.decode())):
+                    threading.Thread(target=self.resync_messages, args=(board,), daemon=True).start()
+
+            elif topic == "message":
+                threading.Thread(target=self.resync_messages, args=(board,), daemon=True).start()
+
+            elif topic == "frame/request":
+                payload = json.loads(msg.payload.decode())
+                if payload.get("mode") != board.mode:
+                    board.mode = payload.get("mode")
+                    board.state = main.ModeState()
+                board.encoder.request_keyframe()
+                board.next_frame = 0
+
+        except Exception as e:
+            print(f"Failed to handle {msg.topic}:", e)
+            return
+
+        self.wake.set()
+
+    def resync_messages(self, board):
+        try:
+            response = response_cache.cached_get(f"messages_{board.board_id}", main.messages_url(board.board_id), timeout=10)
+            payload = json.loads(response.body)
+            board.messages.apply_snapshot(payload["messages"], payload.get("seq"))
+        except Exception as e:
+            print(f"Error fetching messages for {board.board_id}:", e)
+
+    # Rendering
+
+    def use_board(self, board):
+        # The show* functions read the board's globals, so point them at this board
+        main.BOARD_ID = board.board_id
+        main.settings = board.settings
+        main.message_store = board.messages
+        main.current_mode = main.MODES.index(board.mode)
+
+        if board.mode == "metro":
+            snapshot = self.data.departures(board)
+            if snapshot:
+                main.metro_fetcher.publish(snapshot.data, snapshot.timestamp)
+            return snapshot is not None
+
+        if board.mode in ("weather", "weather_graph"):
+            snapshot = self.data.forecast(board)
+            if snapshot:
+                main.weather_fetcher.publish(snapshot.data, snapshot.timestamp)
+            return snapshot is not None
+
+        if board.mode == "films":
+            snapshot = self.data.films.latest()
+            if snapshot:
+                main.films_fetcher.publish(snapshot.data, snapshot.timestamp)
+        return True
+
+    def render(self, board):
+        start = time.perf_counter()
+        image = main.render_frame(board.mode, board.state) if self.use_board(board) else None
+        if image is None:
+            return
+        if self.data.stale(board):
+            image = main.draw_stale_marker(image)
+
+        payload = board.encoder.encode(image, main.MODE_BRIGHTNESS.get(board.mode, 100))
+        metrics.registry.histogram("server_render_seconds", "Time to render and encode a frame, per mode", mode=board.mode).observe(time.perf_counter() - start)
+        if payload is not None:
+            self.client.publish(f"boards/{board.board_id}/frame", payload)
+            metrics.registry.counter("frame_bytes_total", "Encoded frame bytes sent to boards").inc(len(payload))
+
+    def run(self):
+        try:
+            main.stations = get_stations()
+        except Exception as e:
+            print("Error fetching stations:", e)
+            main.stations = cached_stations()
+
+        self.client = mqtt.Client(client_id=main.BOARD_ID)
+        self.client.username_pw_set(main.MQTT_USERNAME, main.MQTT_PASSWORD)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+        self.client.connect(main.MQTT_BROKER, main.MQTT_PORT, 60)
+        self.client.loop_start()
+
+        while True:
+            now = time.monotonic()
+            for board in list(self.boards.values()):
+                if board.mode not in main.MODES or board.mode == "off" or now < board.next_frame:
+                    continue
+                try:
+                    self.render(board)
+                except Exception as e:
+                    print(f"Failed to render {board.mode} for {board.board_id}:", e)
+
+                interval = main.FRAME_INTERVALS[board.mode] or IDLE_FRAME_INTERVAL
+                board.next_frame = now + interval
+
+            due = [b.next_frame for b in self.boards.values() if b.mode not in (None, "off")]
+            timeout = max(min(due) - time.monotonic(), 0) if due else None
+            self.wake.wait(timeout)
+            self.wake.clear()
+
+
+if __name__ == "__main__":
+    RenderServer().run()
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+import metrics
+import http_client
+
+# Upstream responses are kept on disk so the board can show the last data it had
+# straight after a reboot, even if an upstream is down.
+CACHE_DIR = "response_cache"
+
+CachedResponse = namedtuple("CachedResponse", ["url", "body", "fetched_at", "etag", "last_modified"])
+
+_memory = {}
+_lock = threading.Lock()
+
+# A hit is a 304: the stored body was still current
+_hits, _misses = metrics.cache_counters("response")
+
+
+def _path(name):
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+
+def load(name):
+    """
+    Returns the last stored response for `name`, or None if there isn't one.
+    """
+    with _lock:
+        if name in _memory:
+            return _memory[name]
+
+    try:
+        with open(_path(name)) as f:
+            cached = CachedResponse(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+    with _lock:
+        _memory[name] = cached
+    return cached
+
+
+def save(name, cached):
+    with _lock:
+        _memory[name] = cached
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first so a power cut can't leave a half-written entry
+    tmp_path = f"{_path(name)}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cached._asdict(), f)
+    os.replace(tmp_path, _path(name))
+
+
+def cached_get(name, url, session=http_client.session, headers=None, timeout=10, deadline=None):
+    """
+    Fetches `url` through http_client, sending the stored ETag/Last-Modified so an
+    unchanged response isn't downloaded again, and stores the result under `name`.
+    Raises on failure.
+    """
+    cached = load(name)
+    headers = dict(headers or {})
+    if cached and cached.url == url:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    response = http_client.get(url, session=session, headers=headers, timeout=timeout, deadline=deadline)
+
+    if response.status_code == 304 and cached:
+        _hits.inc()
+        cached = cached._replace(fetched_at=time.time())
+    else:
+        _misses.inc()
+        cached = CachedResponse(
+            url=url,
+            body=response.text,
+            fetched_at=time.time(),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified")
+        )
+
+    save(name, cached)
+    return cached
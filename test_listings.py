@@ -0,0 +1,61 @@
+import time
+import threading
+import metrics
+from fetchers import Fetcher, Snapshot
+from get_films import Film, Showtime
+from listings import Listings, Provider
+
+FILMS = [Film("Paddington", [Showtime("23:58", None)])]
+
+
+class FixtureProvider(Provider):
+    # Returns FILMS until it is told to fail
+    def __init__(self, name, cached=None):
+        self.name = name
+        self.cached = cached
+        self.failing = False
+
+    def fetch(self, deadline=None):
+        if self.failing:
+            raise OSError("forced failure")
+        return FILMS
+
+    def load_cached(self):
+        return self.cached
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+def test_refresh_where_every_provider_fails_is_stale():
+    providers = [FixtureProvider("A"), FixtureProvider("B")]
+    listings = Listings(providers)
+    published = threading.Event()
+    fetcher = Fetcher("films-test", listings.fetch, 3600, on_update=published.set)
+    errors = metrics.registry.counter("fetch_errors_total", fetcher="films-test")
+
+    fetcher.start()
+    assert published.wait(5)
+    first = fetcher.latest()
+    assert first.data and not fetcher.stale()
+
+    for provider in providers:
+        provider.failing = True
+    fetcher.refresh()
+    wait_for(fetcher.stale)
+    assert fetcher.latest() is first  # Kept, not republished as if it were new
+    assert errors.value == 1
+
+
+def test_films_from_an_earlier_day_are_not_merged():
+    yesterday = Snapshot(FILMS, time.time() - 2 * 86400)
+    providers = [FixtureProvider("A", cached=yesterday), FixtureProvider("B")]
+    listings = Listings(providers)
+    assert listings.load_cached().data == []
+
+    providers[0].failing = True
+    assert {listing.cinema for listing in listings.fetch()} == {"B"}
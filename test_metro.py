@@ -0,0 +1,33 @@
+import os
+import json
+from metro import PlatformTimes, DepartureTracker, upcoming, minutes_until
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures")
+
+
+def fixture_times():
+    with open(os.path.join(FIXTURES, "metro_times.json")) as f:
+        metro = json.load(f)
+    return [PlatformTimes(*key.split("/"), tuple(trains), 0, None) for key, trains in metro.items()]
+
+
+def test_late_trains_show_as_due_until_the_next_poll():
+    tracker = DepartureTracker()
+    times = tracker.update(fixture_times(), fetched_at=1000)
+    first = times[0].trains[0]
+    assert first.train["dueIn"] == -1
+
+    # Long after DEPARTED_AFTER, but no poll has dropped the train yet
+    now = 1000 + 300
+    shown = upcoming(times[0].trains, now)
+    assert shown[0] is first
+    assert minutes_until(first, now) <= 0
+    assert [d.train["dueIn"] for d in upcoming(times[1].trains, now)][0] == 0
+
+
+def test_next_poll_drops_departed_trains():
+    tracker = DepartureTracker()
+    tracker.update(fixture_times(), fetched_at=1000)
+    later = [t._replace(trains=t.trains[1:]) for t in fixture_times()]
+    times = tracker.update(later, fetched_at=1015)
+    assert all(int(d.train["dueIn"]) > 0 for t in times for d in upcoming(t.trains, 1015))